@@ -0,0 +1,87 @@
+# Fetch N copies of a page (distinct URLs, so nothing is shared or cached) from a local
+# server: one after another with URL.request, through the thread-pool SCHEDULER, and
+# concurrently with the asyncio fetch. Both concurrent paths are held to the same
+# MAX_REQUESTS_PER_HOST, so the connections column should never go past it.
+#
+#   python -m benchmarks.bench_async_fetch [N] [latency_ms]
+
+import asyncio
+import http.server
+import sys
+import threading
+import time
+from src.async_loader import fetch
+from src.connection_pool import POOL
+from src.scheduler import SCHEDULER, DOCUMENT
+from src.server import do_request
+from src.url_loader import URL
+
+# Serves src/server.py's pages over HTTP/1.1 keep-alive, after an artificial delay
+# standing in for a slow backend or a long round trip
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True      # headers and body go out as separate writes
+    latency = 0.05
+    connections = 0
+
+    def setup(self):
+        Handler.connections += 1
+        super().setup()
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        status, body = do_request("GET", self.path.split("?", 1)[0], dict(self.headers), None)
+        body = body.encode("utf8")
+        self.send_response(int(status.split(" ", 1)[0]))
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_server(latency):
+    Handler.latency = latency
+    http.server.ThreadingHTTPServer.request_queue_size = 256   # let all N clients connect at once
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def timed(label, n, fn):
+    POOL.close_all()
+    Handler.connections = 0
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print("{:<12} {:>8.3f}s  {:>8.1f} pages/s  {:>4} connections".format(label, elapsed, n / elapsed, Handler.connections))
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.05
+    server = start_server(latency)
+    urls = [URL("http://127.0.0.1:{}/?{}".format(server.server_address[1], i)) for i in range(n)]
+    print("{} fetches, {:.0f}ms server latency".format(n, latency * 1000))
+
+    def sequential():
+        for url in urls:
+            url.request()
+
+    def scheduled():
+        futures = [SCHEDULER.submit(url, DOCUMENT) for url in urls]
+        for future in futures:
+            future.result()
+
+    def concurrent():
+        async def run():
+            await asyncio.gather(*[fetch(url) for url in urls])
+        asyncio.run(run())
+
+    timed("sequential", n, sequential)
+    timed("scheduler", n, scheduled)
+    timed("asyncio", n, concurrent)
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# Build the tree of generated documents by parsing them and from DOMCache, check both
+# trees are the same, and report the time of each and the serialized size.
+# (a first visit serializes the tree on the cache's writer thread; that is waited
+# for between the two, but not counted in either)
+#
+#   python -m benchmarks.bench_dom_cache [MB]
+
+import gc
+import sys
+import time
+from src.dom_cache import DOMCache
+from benchmarks.bench_html_parse import markup_heavy, text_heavy, script_heavy, dump
+
+def timed(cache, body):
+    gc.collect()
+    start = time.perf_counter()
+    root, _ = cache.parse(body)
+    elapsed = time.perf_counter() - start
+    return repr(dump(root)), elapsed
+
+def main():
+    size = int(float(sys.argv[1]) * 1024 * 1024) if len(sys.argv) > 1 else 2 * 1024 * 1024
+    print("{:<14} {:>8} {:>10} {:>10} {:>8} {:>12}".format("document", "MB", "parse", "cached", "speedup", "serialized"))
+    cache = DOMCache(memory_bytes=1024 * 1024 * 1024)
+    for name, make in [("markup-heavy", markup_heavy), ("text-heavy", text_heavy), ("script-heavy", script_heavy)]:
+        body = make(size)
+        mb = len(body.encode("utf8")) / (1024 * 1024)
+        parsed, miss = timed(cache, body)
+        cache.flush()
+        cached, hit = timed(cache, body)
+        assert parsed == cached, "trees differ"
+        print("{:<14} {:>8.1f} {:>8.3f} s {:>8.3f} s {:>7.1f}x {:>9.1f} MB".format(
+            name, mb, miss, hit, miss / hit, cache.memory.bytes / (1024 * 1024)))
+        cache.clear()
+    print("stats", cache.stats.snapshot())
+
+if __name__ == "__main__":
+    main()
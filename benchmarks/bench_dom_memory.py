@@ -0,0 +1,81 @@
+# Build the same generated document as dict-based nodes (what Text / Element used to be)
+# and as the __slots__ nodes HTMLParser makes now, style both, and report bytes per node.
+#
+#   python -m benchmarks.bench_dom_memory [MB]
+
+import gc
+import sys
+import tracemalloc
+from src.html_parser import HTMLParser, Element, Text
+from src.styles import style
+from src.constants import INHERITED_PROPERTIES
+from benchmarks.bench_html_parse import markup_heavy, text_heavy
+
+# The node classes as they were: a __dict__, a children list, an attributes dict
+# and a style dict on every single node
+class LegacyText:
+    def __init__(self, text, parent):
+        self.text = text
+        self.children = []
+        self.parent = parent
+        self.style = {}
+        self.is_focused = False
+
+class LegacyElement:
+    def __init__(self, tag, attributes, parent):
+        self.tag = tag
+        self.attributes = attributes
+        self.children = []
+        self.parent = parent
+        self.style = {}
+        self.is_focused = False
+
+# What style() allocated per node before: every node, text included, its own dict
+def legacy_style(node):
+    node.style = dict(node.parent.style) if node.parent else dict(INHERITED_PROPERTIES)
+    for child in node.children:
+        legacy_style(child)
+
+def legacy_copy(node, parent=None):
+    if isinstance(node, Text):
+        return LegacyText(node.text, parent)
+    copy = LegacyElement(node.tag, dict(node.attributes), parent)
+    copy.children = [legacy_copy(child, copy) for child in node.children]
+    return copy
+
+def compact_copy(node, parent=None):
+    if isinstance(node, Text):
+        return Text(node.text, parent)
+    copy = Element(node.tag, dict(node.attributes) if node.attributes else None, parent)
+    for child in node.children:
+        copy.add_child(compact_copy(child, copy))
+    return copy
+
+def count(node):
+    return 1 + sum(count(child) for child in node.children)
+
+# Bytes allocated to build and style a copy of tree. Text and tag strings are shared
+# with the original tree, so only the node structure itself is counted.
+def measured(copy, style, tree):
+    gc.collect()
+    tracemalloc.start()
+    root = copy(tree)
+    style(root)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size
+
+def main():
+    size = int(float(sys.argv[1]) * 1024 * 1024) if len(sys.argv) > 1 else 1024 * 1024
+    sys.setrecursionlimit(10000)
+    print("{:<14} {:>9} {:>14} {:>14} {:>8}".format("document", "nodes", "dict nodes", "slots nodes", "saved"))
+    for name, make in [("markup-heavy", markup_heavy), ("text-heavy", text_heavy)]:
+        tree = HTMLParser(make(size)).parse()
+        nodes = count(tree)
+        old = measured(legacy_copy, legacy_style, tree)
+        new = measured(compact_copy, lambda root: style(root, []), tree)
+        print("{:<14} {:>9} {:>8.0f} B/node {:>8.0f} B/node {:>7.0%}".format(
+            name, nodes, old / nodes, new / nodes, 1 - new / old))
+
+if __name__ == "__main__":
+    main()
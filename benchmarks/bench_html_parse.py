@@ -0,0 +1,86 @@
+# Parse generated multi-megabyte documents with HTMLParser and with the old
+# character-at-a-time loop it replaced, check both build the same tree, and report MB/s.
+# (Not for script-heavy: the old loop tokenized <script> contents as markup, and every
+# "i < n" in them opened an element that never closed.)
+#
+#   python -m benchmarks.bench_html_parse [MB]
+
+import gc
+import sys
+import time
+from src.html_parser import HTMLParser, Element
+
+# The tokenizer HTMLParser.parse used to have: one iteration and one += per character
+class CharLoopParser(HTMLParser):
+    def parse(self):
+        text = ""
+        in_tag = False
+        for c in self.body:
+            if c == "<":
+                in_tag = True
+                if text: self.add_text(text)
+                text = ""
+            elif c == ">":
+                in_tag = False
+                self.add_tag(text)
+                text = ""
+            else:
+                text += c
+        if not in_tag and text:
+            self.add_text(text)
+        return self.finish()
+
+def markup_heavy(size):
+    row = ('<div class="row"><a href="/item?id={0}">item {0}</a> <span id=s{0}>'
+           'x<b>bold</b><br><img src=i{0}.png></span></div>\n')
+    return document(lambda i: row.format(i), size)
+
+def text_heavy(size):
+    paragraph = "<p>" + "All work and no play makes Jack a dull boy. " * 400 + "</p>\n"
+    return document(lambda i: paragraph, size)
+
+def script_heavy(size):
+    script = ("<script>for (let i = 0; i < n; i++) {{ if (a[i] > b) el.innerHTML += '<li>' + i + '</li>'; }}"
+              * 40 + "</script>\n<p>paragraph {0}</p>\n")
+    return document(lambda i: script.format(i), size)
+
+def document(piece, size):
+    parts = ["<!doctype html><html><head><title>bench</title>",
+             "<link rel=stylesheet href=style.css></head><body>"]
+    total, i = 0, 0
+    while total < size:
+        parts.append(piece(i))
+        total += len(parts[-1])
+        i += 1
+    parts.append("</body></html>")
+    return "".join(parts)
+
+def dump(node):
+    if isinstance(node, Element):
+        return (node.tag, node.attributes, [dump(child) for child in node.children])
+    return node.text
+
+# The tree as one string, and the seconds it took to parse. Nothing of the tree stays
+# alive, so the next parser doesn't pay for the garbage collector walking over it.
+def timed(parser_class, body, compare=True):
+    gc.collect()
+    start = time.perf_counter()
+    tree = parser_class(body).parse()
+    elapsed = time.perf_counter() - start
+    return repr(dump(tree)) if compare else None, elapsed
+
+def main():
+    size = int(float(sys.argv[1]) * 1024 * 1024) if len(sys.argv) > 1 else 4 * 1024 * 1024
+    print("{:<14} {:>8} {:>12} {:>12} {:>8}".format("document", "MB", "char loop", "HTMLParser", "speedup"))
+    for name, make, same_tree in [("markup-heavy", markup_heavy, True), ("text-heavy", text_heavy, True),
+                                  ("script-heavy", script_heavy, False)]:
+        body = make(size)
+        mb = len(body.encode("utf8")) / (1024 * 1024)
+        old_tree, old = timed(CharLoopParser, body, same_tree)
+        new_tree, new = timed(HTMLParser, body, same_tree)
+        assert old_tree == new_tree, "trees differ"
+        print("{:<14} {:>8.1f} {:>7.1f} MB/s {:>7.1f} MB/s {:>7.1f}x".format(
+            name, mb, mb / old, mb / new, old / new))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# Style generated pages, once the way style() used to (every rule against every element,
+# descendant selectors matched by nested walks up the tree) and once as it does now
+# (RuleIndex, AncestorFilter, one walk per selector chain), check both give every node
+# the same style, and report the time of each. Two cases: a framework-sized stylesheet
+# on a flat page, and "div p span"-style rules on a deeply nested one.
+#
+#   python -m benchmarks.bench_style [rules]
+
+import gc
+import random
+import sys
+import time
+from src.html_parser import HTMLParser, Element, Text
+from src.styles import CSSParser, RuleIndex, DescendantSelector, DEFAULT_STYLE_SHEET, style, cascade_priority
+from src.constants import INHERITED_PROPERTIES
+from benchmarks.bench_html_parse import markup_heavy
+
+TAGS = ["div", "span", "a", "p", "ul", "li", "b", "i", "img", "section", "header", "footer",
+        "nav", "table", "tr", "td", "h1", "h2", "h3", "button", "input", "form", "label", "em"]
+
+# Mostly class rules, as in a CSS framework (the parser takes ".btn-lg" for a tag that
+# never matches), plus descendant chains and plain tag rules
+def stylesheet(count, seed=1):
+    rng = random.Random(seed)
+    rules = []
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.6:
+            selector = ".c{}-{}".format(i, rng.choice(TAGS))
+        elif kind < 0.9:
+            selector = " ".join(rng.choice(TAGS) for _ in range(rng.randint(2, 4)))
+        else:
+            selector = rng.choice(TAGS)
+        rules.append("{} {{ color: c{}; font-weight: bold; }}".format(selector, i))
+    return "\n".join(rules)
+
+def deep_stylesheet():
+    chains = ["div p span", "section div p span", "div div div span", "article p span",
+              "nav ul li a", "div section span", "footer div span", "div p b", "header span"]
+    return "\n".join("{} {{ color: c{}; }}".format(chain, i) for i, chain in enumerate(chains * 20))
+
+# Every leaf 80 elements down
+def deep_document(leaves, depth=80):
+    opening = "".join("<div>" if i % 3 else "<section>" for i in range(depth))
+    closing = "".join("</div>" if i % 3 else "</section>" for i in reversed(range(depth)))
+    return "<html><body>" + "".join(
+        opening + "<p><span>leaf {}</span></p>".format(i) + closing for i in range(leaves)) + "</body></html>"
+
+# DescendantSelector.matches as it was: for each ancestor, the whole left side again
+def legacy_matches(selector, node):
+    if not isinstance(selector, DescendantSelector):
+        return selector.matches(node)
+    if not legacy_matches(selector.descendant, node): return False
+    while node.parent:
+        if legacy_matches(selector.ancestor, node.parent): return True
+        node = node.parent
+    return False
+
+# style() as it was: the whole sorted list for every element
+def linear_style(node, rules):
+    if isinstance(node, Text):
+        node.style = node.parent.style
+        return
+    node.style = {}
+    for property, default_value in INHERITED_PROPERTIES.items():
+        node.style[property] = node.parent.style[property] if node.parent else default_value
+    for selector, body in rules:
+        if not legacy_matches(selector, node): continue
+        for property, value in body.items():
+            node.style[property] = value
+    if isinstance(node, Element) and "style" in node.attributes:
+        for property, value in CSSParser(node.attributes["style"]).body().items():
+            node.style[property] = value
+    if node.style["font-size"].endswith("%"):
+        parent_font_size = node.parent.style["font-size"] if node.parent else INHERITED_PROPERTIES["font-size"]
+        node.style["font-size"] = str(float(node.style["font-size"][:-1]) / 100 * float(parent_font_size[:-2])) + "px"
+    for child in node.children:
+        linear_style(child, rules)
+
+def styles(node, out):
+    out.append(node.style)
+    for child in node.children:
+        styles(child, out)
+    return out
+
+def timed(function, tree, rules):
+    gc.collect()
+    start = time.perf_counter()
+    function(tree, rules)
+    elapsed = time.perf_counter() - start
+    return repr(styles(tree, [])), elapsed
+
+def compare(name, css, body):
+    rules = sorted(DEFAULT_STYLE_SHEET + CSSParser(css).parse(), key=cascade_priority)
+    tree = HTMLParser(body).parse()
+    old_styles, old = timed(linear_style, tree, rules)
+    new_styles, new = timed(style, tree, RuleIndex(rules))
+    assert old_styles == new_styles, "styles differ"
+    print("{:<10} {:>6} {:>7} {:>10.3f} s {:>8.3f} s {:>7.1f}x".format(
+        name, len(rules), len(styles(tree, [])), old, new, old / new))
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    sys.setrecursionlimit(10000)
+    print("{:<10} {:>6} {:>7} {:>12} {:>10} {:>8}".format("page", "rules", "nodes", "before", "now", "speedup"))
+    compare("framework", stylesheet(count), markup_heavy(256 * 1024))
+    compare("deep", deep_stylesheet(), deep_document(200))
+
+if __name__ == "__main__":
+    main()
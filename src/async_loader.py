@@ -0,0 +1,462 @@
+import asyncio
+import heapq
+import itertools
+import socket
+import ssl
+import sys
+import time
+import traceback
+import weakref
+from src.connection_pool import MAX_IDLE_PER_HOST, MAX_IDLE_TOTAL, IDLE_TIMEOUT
+from src.dns_cache import RESOLVER, CONNECT_DELAY
+from src.http_decoding import ConnectionClosed, READ_SIZE, content_decoders, decode_chunk, flush_decoders, has_framing
+from src.http_cache import HTTP_CACHE
+from src.http_reader import decode_text, parse_head
+from src.request_timing import RequestTiming
+from src.scheduler import DOCUMENT, PREFETCH, MAX_REQUESTS_PER_HOST, MAX_REQUESTS_TOTAL
+from src.single_flight import ASYNC_IN_FLIGHT, flight_key
+from src.tls import SESSIONS, TLS_STATS, SessionOffer
+from src.transport import get_transport
+from src.url_loader import keeps_alive, has_body, may_retry, is_redirect, redirect_target, LOCAL_SCHEMES, \
+    PERMANENT_REDIRECTS, PERMANENT_REDIRECT_STATUSES, MAX_REDIRECTS, TooManyRedirects
+
+TICK_MS = 10        # how often the Tk event loop lets asyncio run
+
+class AsyncConnection:
+    def __init__(self, key, reader, writer):
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.last_used = time.monotonic()
+        self.reused = False
+
+    def looks_closed(self):
+        return self.reader.at_eof() or self.writer.is_closing()
+
+    # Same as Connection.save_session; the session lives on the stream's SSLObject
+    def save_session(self):
+        if self.key[0] == "https":
+            SESSIONS.save(self.writer.get_extra_info("ssl_object"), self.key[1], self.key[2])
+
+    def close(self):
+        self.writer.close()
+
+# RequestScheduler's rules for the asyncio path: at most max_per_host requests on the
+# wire per host and max_total in all, and a freed slot goes to the most urgent waiter
+# whose host has room (equal priorities in arrival order).
+class RequestGate:
+    def __init__(self, max_per_host=MAX_REQUESTS_PER_HOST, max_total=MAX_REQUESTS_TOTAL):
+        self.max_per_host = max_per_host
+        self.max_total = max_total
+        self.waiting = []           # heap of (priority, seq, host key, future)
+        self.active = {}            # host key -> number of requests holding a slot
+        self.running = 0
+        self.seq = itertools.count()
+
+    def has_room(self, key):
+        return self.running < self.max_total and self.active.get(key, 0) < self.max_per_host
+
+    def take(self, key):
+        self.active[key] = self.active.get(key, 0) + 1
+        self.running += 1
+
+    async def enter(self, key, priority=DOCUMENT):
+        if self.has_room(key):
+            self.take(key)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (priority, next(self.seq), key, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.leave(key)     # handed a slot just as the request was cancelled
+            raise
+
+    def leave(self, key):
+        self.active[key] -= 1
+        if not self.active[key]:
+            del self.active[key]
+        self.running -= 1
+        self.wake()
+
+    def wake(self):
+        skipped = []
+        while self.waiting and self.running < self.max_total:
+            waiter = heapq.heappop(self.waiting)
+            priority, seq, key, future = waiter
+            if future.done(): continue          # cancelled while it waited
+            if self.active.get(key, 0) < self.max_per_host:
+                self.take(key)
+                future.set_result(None)
+            else:
+                skipped.append(waiter)
+        for waiter in skipped:
+            heapq.heappush(self.waiting, waiter)
+
+# Keep-alive pool for asyncio streams, with the same idle limits as connection_pool.POOL
+# and its gate for the number of requests in flight. Streams belong to the loop that
+# opened them, so every running loop gets its own pool (see get_pool).
+class AsyncConnectionPool:
+    def __init__(self, max_idle_per_host=MAX_IDLE_PER_HOST,
+                 max_idle_total=MAX_IDLE_TOTAL, idle_timeout=IDLE_TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.max_idle_total = max_idle_total
+        self.idle_timeout = idle_timeout
+        self.idle = {}              # (scheme, host, port) -> list of idle AsyncConnections, most recently used last
+        self.gate = RequestGate()
+
+    async def acquire(self, scheme, host, port):
+        key = (scheme, host, port)
+        self.expire(time.monotonic())
+        conns = self.idle.get(key, [])
+        while conns:
+            conn = conns.pop()
+            if not conns:
+                del self.idle[key]
+            if conn.looks_closed():
+                conn.close()
+                continue
+            conn.reused = True
+            return conn
+        # Resolve through the shared DNS cache on a worker thread (getaddrinfo blocks), then race the addresses
+        start = time.perf_counter()
+        addresses = await asyncio.get_running_loop().run_in_executor(None, RESOLVER.resolve, host, port)
+        resolved = time.perf_counter()
+        sock = await connect_addresses(addresses)
+        connected = time.perf_counter()
+        if scheme == "https":
+            reader, writer = await open_tls(sock, host, port)
+        else:
+            reader, writer = await asyncio.open_connection(sock=sock)
+        conn = AsyncConnection(key, reader, writer)
+        conn.dns_time = resolved - start
+        conn.connect_time = connected - resolved
+        conn.tls_time = time.perf_counter() - connected if scheme == "https" else 0.0
+        return conn
+
+    def release(self, conn):
+        conn.save_session()
+        conn.last_used = time.monotonic()
+        conns = self.idle.setdefault(conn.key, [])
+        conns.append(conn)
+        if len(conns) > self.max_idle_per_host:
+            conns.pop(0).close()
+        while self.idle_count() > self.max_idle_total:
+            self.evict_oldest()
+
+    def discard(self, conn):
+        conn.save_session()
+        conn.close()
+
+    # DNS, TCP and TLS ahead of time, like ConnectionPool.preconnect. Opening the
+    # connection takes a slot at PREFETCH priority, so it never holds up a real request.
+    async def preconnect(self, scheme, host, port):
+        key = (scheme, host, port)
+        if self.idle.get(key): return False
+        await self.gate.enter(key, PREFETCH)
+        try:
+            conn = await self.acquire(scheme, host, port)
+        finally:
+            self.gate.leave(key)
+        self.release(conn)
+        return True
+
+    def expire(self, now):
+        for key in list(self.idle):
+            fresh = []
+            for conn in self.idle[key]:
+                if now - conn.last_used > self.idle_timeout:
+                    conn.close()
+                else:
+                    fresh.append(conn)
+            if fresh:
+                self.idle[key] = fresh
+            else:
+                del self.idle[key]
+
+    def idle_count(self):
+        return sum(len(conns) for conns in self.idle.values())
+
+    def evict_oldest(self):
+        key = min(self.idle, key=lambda k: self.idle[k][0].last_used)
+        self.idle[key].pop(0).close()
+        if not self.idle[key]:
+            del self.idle[key]
+
+# The handshake over an already connected socket, offering the cached TLS session
+# and counted in TLS_STATS just like tls.wrap_socket
+async def open_tls(sock, host, port):
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.open_connection(
+            sock=sock, ssl=SessionOffer(host, port), server_hostname=host)
+    except ssl.SSLError:
+        SESSIONS.forget(host, port)
+        raise
+    TLS_STATS.record(time.perf_counter() - start, writer.get_extra_info("ssl_object").session_reused)
+    return reader, writer
+
+# asyncio version of dns_cache.happy_eyeballs_connect
+async def connect_addresses(addresses, delay=CONNECT_DELAY):
+    loop = asyncio.get_running_loop()
+    pending = set()
+    last_error = None
+    remaining = list(addresses)
+    try:
+        while remaining or pending:
+            if remaining:
+                family, type, proto, _, sockaddr = remaining.pop(0)
+                sock = socket.socket(family, type, proto)
+                sock.setblocking(False)
+                task = loop.create_task(loop.sock_connect(sock, sockaddr))
+                task.sock = sock
+                pending.add(task)
+            done, pending = await asyncio.wait(
+                pending, timeout=delay if remaining else None, return_when=asyncio.FIRST_COMPLETED)
+            winner = None
+            for task in done:
+                if task.exception() is None and winner is None:
+                    winner = task.sock
+                    continue
+                task.sock.close()
+                last_error = task.exception() or last_error
+            if winner is not None:
+                return winner
+        raise last_error or OSError("no addresses to connect to")
+    finally:
+        for task in pending:
+            task.cancel()
+            task.sock.close()
+
+_pools = weakref.WeakKeyDictionary()   # event loop -> AsyncConnectionPool
+
+def get_pool():
+    loop = asyncio.get_running_loop()
+    if loop not in _pools:
+        _pools[loop] = AsyncConnectionPool()
+    return _pools[loop]
+
+# A warm connection to url's origin in the running loop's pool (Prefetcher's preconnect
+# for tabs that load pages on a TkAsyncBridge)
+async def warm_connection(url):
+    return await get_pool().preconnect(url.scheme, url.host, url.port)
+
+# Same framings as http_decoding.read_body, reading from an asyncio.StreamReader
+async def read_chunks(reader, headers, timing=None):
+    transfer_encoding = headers.get("transfer-encoding", "").casefold()
+    if "chunked" in transfer_encoding:
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionClosed("connection closed in the middle of a chunked body")
+            if timing: timing.bytes_received += len(line) + 2      # size line and the chunk's CRLF
+            size = int(line.split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""): pass
+                return
+            if timing: timing.bytes_received += size
+            try:
+                yield await reader.readexactly(size)
+            except asyncio.IncompleteReadError:
+                raise ConnectionClosed("connection closed in the middle of a chunk")
+            await reader.readline()
+    elif "content-length" in headers:
+        remaining = int(headers["content-length"])
+        while remaining > 0:
+            data = await reader.read(min(remaining, READ_SIZE))
+            if not data:
+                raise ConnectionClosed("connection closed in the middle of the body")
+            remaining -= len(data)
+            if timing: timing.bytes_received += len(data)
+            yield data
+    else:
+        while True:
+            data = await reader.read(READ_SIZE)
+            if not data: return
+            if timing: timing.bytes_received += len(data)
+            yield data
+
+async def read_body(reader, headers, timing=None, on_piece=None):
+    decoders = content_decoders(headers.get("content-encoding", ""))
+    parts = []
+    async for chunk in read_chunks(reader, headers, timing):
+        parts.append(decode_chunk(decoders, chunk))
+        if on_piece: on_piece(parts[-1])
+    parts.append(flush_decoders(decoders))
+    if on_piece: on_piece(parts[-1])
+    return b"".join(parts)
+
+async def exchange(url, conn, method, payload, headers, timing, sink=None):
+    request = url.request_bytes(method, payload, headers)
+    start = time.perf_counter()
+    conn.writer.write(request)
+    await conn.writer.drain()
+    sent = time.perf_counter()
+    timing.bytes_sent = len(request)
+
+    statusline = await conn.reader.readline()
+    if not statusline:
+        raise ConnectionClosed("connection closed before a response arrived")
+    timing.bytes_received = len(statusline)
+    lines = [statusline]
+    while True:
+        line = await conn.reader.readline()
+        timing.bytes_received += len(line)
+        if line in (b"\r\n", b"\n", b""): break
+        lines.append(line)
+    version, status, explanation, response_headers = \
+        parse_head([line.decode("utf8", "replace").rstrip("\r\n") for line in lines])
+    head_in = time.perf_counter()
+
+    keep_alive = keeps_alive(version, response_headers)
+    if not has_body(method, status):
+        content = b""
+    else:
+        if sink and not is_redirect(status, response_headers):
+            sink.begin(response_headers, url)
+            content = await read_body(conn.reader, response_headers, timing, sink.write)
+            sink.end()
+        else:
+            content = await read_body(conn.reader, response_headers, timing)
+        if not has_framing(response_headers):
+            keep_alive = False
+
+    timing.send = sent - start
+    timing.ttfb = head_in - sent
+    timing.download = time.perf_counter() - head_in
+    return status, response_headers, content, keep_alive
+
+# The asyncio counterpart of URL.request: same cache, same redirect handling, same
+# in-flight sharing, framing and decoding, but waiting on the network never blocks the thread.
+# priority is one of SCHEDULER's classes and decides who goes first when a host is busy.
+async def fetch(url, payload=None, max_redirects=MAX_REDIRECTS, log=None, sink=None, priority=DOCUMENT):
+    return (await fetch_with_url(url, payload, max_redirects, log, sink, priority))[1]
+
+# fetch's body along with the URL it came from (the redirect target, if there was one)
+async def fetch_with_url(url, payload=None, max_redirects=MAX_REDIRECTS, log=None, sink=None, priority=DOCUMENT):
+    if url.scheme in LOCAL_SCHEMES:
+        # No network to wait on, but a big file still takes a while to decode
+        return await asyncio.get_running_loop().run_in_executor(
+            None, lambda: url.request_with_url(payload, log=log, sink=sink))
+    if payload:
+        return await follow_redirects(url, payload, max_redirects, log, sink, priority)
+    timing = RequestTiming(url, "GET")      # logged only if another caller's transfer is used
+    return await ASYNC_IN_FLIGHT.do(flight_key("GET", url),
+                                    lambda: follow_redirects(url, None, max_redirects, log, sink, priority),
+                                    lambda error: timing.shared(log, error))
+
+async def follow_redirects(url, payload, max_redirects, log=None, sink=None, priority=DOCUMENT):
+    start = url
+    url = PERMANENT_REDIRECTS.lookup(url) if not payload else url
+    for hop in range(max_redirects + 1):
+        status, response_headers, content = await fetch_once(url, payload, log, sink, priority)
+        target = redirect_target(url, status, response_headers)
+        if target is None:
+            return url, decode_text(content, response_headers)
+        if status in PERMANENT_REDIRECT_STATUSES:
+            PERMANENT_REDIRECTS.remember(url, target)
+        if status == 303 or (payload and status in (301, 302)):
+            payload = None
+        url = target
+    raise TooManyRedirects("more than {} redirects from {}".format(max_redirects, start))
+
+async def fetch_once(url, payload=None, log=None, sink=None, priority=DOCUMENT):
+    method = "POST" if payload else "GET"
+    timing = RequestTiming(url, method)
+    try:
+        result = await cached_or_fetched(url, method, payload, timing, sink, priority)
+    except BaseException as e:     # cancelled too: a tab that navigated away
+        timing.finish(error=e)
+        raise
+    else:
+        timing.finish(result[0])
+    finally:
+        if log is not None: log.add(timing)
+    return result
+
+async def cached_or_fetched(url, method, payload, timing, sink=None, priority=DOCUMENT):
+    key = str(url)
+    transport = get_transport()
+
+    entry = HTTP_CACHE.lookup_fresh(key, method) if transport.cached else None    # see Transport.cached
+    if entry and entry.is_fresh():
+        timing.source = "cache"
+        return entry.status, entry.headers, entry.body
+    headers = HTTP_CACHE.conditional_headers(entry)
+
+    # Waits for a slot under the same per-host and total caps as SCHEDULER, whatever the transport
+    pool = get_pool()
+    host_key = (url.scheme, url.host, url.port)
+    await pool.gate.enter(host_key, priority)
+    try:
+        if not transport.network:
+            status, response_headers, content = await transport.fetch_async(url, method, payload, headers, timing, sink)
+        else:
+            status, response_headers, content = await fetch_pooled(pool, url, method, payload, headers, timing, sink)
+    finally:
+        pool.gate.leave(host_key)
+    if not transport.cached:
+        return status, response_headers, content
+    if status == 304 and entry:
+        timing.source = "revalidated"
+    return HTTP_CACHE.complete(key, method, entry, status, response_headers, content)
+
+async def fetch_pooled(pool, url, method, payload, headers, timing, sink=None):
+    for attempt in range(2):
+        conn = await pool.acquire(url.scheme, url.host, url.port)
+        timing.connection(conn)
+        timing.bytes_received = 0
+        try:
+            status, response_headers, content, keep_alive = \
+                await exchange(url, conn, method, payload, headers, timing, sink)
+        except (OSError, asyncio.IncompleteReadError):
+            pool.discard(conn)
+            if attempt == 0 and may_retry(conn, method, timing.bytes_received): continue
+            raise
+        except BaseException:
+            pool.discard(conn)      # garbled response, or cancelled mid-exchange: close the stream
+            raise
+        break
+
+    if keep_alive:
+        pool.release(conn)
+    else:
+        pool.discard(conn)
+    return status, response_headers, content
+
+# Drives an asyncio event loop from inside tkinter's mainloop. Every TICK_MS the loop
+# runs whatever is ready (without waiting), then hands control back to Tk.
+class TkAsyncBridge:
+    def __init__(self, window, on_done=None, interval=TICK_MS):
+        self.window = window
+        self.on_done = on_done      # called after each task finishes, e.g. Browser.draw
+        self.interval = interval
+        self.loop = asyncio.new_event_loop()
+        self.window.after(self.interval, self.tick)
+
+    def tick(self):
+        self.loop.call_soon(self.loop.stop)     # stop after one pass over ready callbacks and I/O
+        self.loop.run_forever()
+        self.window.after(self.interval, self.tick)
+
+    def run(self, coro):
+        task = self.loop.create_task(coro)
+        task.add_done_callback(self.finished)
+        return task
+
+    def finished(self, task):
+        if task.cancelled(): return
+        error = task.exception()
+        if error is not None:
+            traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
+        if self.on_done:
+            self.on_done()
+
+"""
+Example: clicking a link while another tab is still loading
+    Tab.click -> Tab.navigate(url) -> bridge.run(tab.load_async(url))
+    Tk returns to its mainloop at once, so scrolling and typing keep working
+    every 10ms tick() lets asyncio advance both downloads a little
+    when load_async finishes, on_done() redraws the window
+"""
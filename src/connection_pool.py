@@ -0,0 +1,173 @@
+import select
+import ssl
+import threading
+import time
+from src.dns_cache import RESOLVER, happy_eyeballs_connect
+from src.http_reader import ResponseReader
+from src.tls import wrap_socket, SESSIONS
+
+MAX_IDLE_PER_HOST = 6       # idle sockets kept per (scheme, host, port)
+MAX_IDLE_TOTAL = 32         # idle sockets kept across all hosts
+IDLE_TIMEOUT = 30           # seconds an idle socket may sit in the pool before we drop it
+
+class Connection:
+    def __init__(self, scheme, host, port):
+        self.key = (scheme, host, port)
+        # Cached DNS, then race the addresses. Each step is timed for request_timing.
+        start = time.perf_counter()
+        addresses = RESOLVER.resolve(host, port)
+        resolved = time.perf_counter()
+        s = happy_eyeballs_connect(addresses)
+        connected = time.perf_counter()
+        self.dns_time = resolved - start
+        self.connect_time = connected - resolved
+        self.tls_time = 0.0
+
+        if scheme == "https":
+            s = wrap_socket(s, host, port)
+            self.tls_time = time.perf_counter() - connected
+
+        self.sock = s
+        # Kept for the lifetime of the connection, because its buffer
+        # may already hold bytes that belong to the next response.
+        self.reader = ResponseReader(s)
+        self.last_used = time.monotonic()
+        self.reused = False         # True once the connection has come back out of the pool
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    # An idle keep-alive socket should have nothing to read. If it is readable,
+    # the server has closed it (EOF) or sent something we never asked for.
+    def looks_closed(self):
+        if self.reader.buffered(): return True
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        if not readable: return False
+        if not isinstance(self.sock, ssl.SSLSocket): return True
+        return self.tls_closed()
+
+    # Over TLS 1.3 a readable socket may only hold the session tickets the server sent
+    # after the handshake (always the case for a preconnected one nobody has read from).
+    # A non-blocking read takes in those records; the socket is only done if it reaches
+    # EOF or actual data, which on an idle connection is as bad as EOF anyway.
+    def tls_closed(self):
+        timeout = self.sock.gettimeout()
+        self.sock.setblocking(False)
+        try:
+            self.sock.recv(1)
+            return True
+        except ssl.SSLWantReadError:
+            return False
+        except (OSError, ValueError):
+            return True
+        finally:
+            self.sock.settimeout(timeout)
+
+    # Keep the TLS session around so the next connection to this host can resume it
+    def save_session(self):
+        if self.key[0] == "https":
+            SESSIONS.save(self.sock, self.key[1], self.key[2])
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+class ConnectionPool:
+    def __init__(self, max_idle_per_host=MAX_IDLE_PER_HOST,
+                 max_idle_total=MAX_IDLE_TOTAL, idle_timeout=IDLE_TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.max_idle_total = max_idle_total
+        self.idle_timeout = idle_timeout
+        self.idle = {}              # (scheme, host, port) -> list of idle Connections, most recently used last
+        self.lock = threading.Lock()
+
+    # Hand out an idle connection for this origin if a usable one exists, otherwise open a new one.
+    def acquire(self, scheme, host, port):
+        key = (scheme, host, port)
+        now = time.monotonic()
+        with self.lock:
+            self.expire(now)
+            conns = self.idle.get(key, [])
+            while conns:
+                conn = conns.pop()
+                if conns == []:
+                    del self.idle[key]
+                if conn.looks_closed():
+                    conn.close()
+                    continue
+                conn.reused = True
+                return conn
+        return Connection(scheme, host, port)
+
+    # Park a connection whose response was fully read, so the next request to the same origin can reuse it.
+    def release(self, conn):
+        conn.save_session()
+        conn.last_used = time.monotonic()
+        with self.lock:
+            conns = self.idle.setdefault(conn.key, [])
+            conns.append(conn)
+            if len(conns) > self.max_idle_per_host:
+                conns.pop(0).close()
+            while self.idle_count() > self.max_idle_total:
+                self.evict_oldest()
+
+    # DNS, TCP and TLS ahead of time: park a ready connection for this origin unless one is idle already
+    def preconnect(self, scheme, host, port):
+        key = (scheme, host, port)
+        with self.lock:
+            if self.idle.get(key): return False
+        self.release(Connection(scheme, host, port))
+        return True
+
+    def discard(self, conn):
+        conn.save_session()
+        conn.close()
+
+    # Drop idle connections the server has probably timed out already. Caller holds the lock.
+    def expire(self, now):
+        for key in list(self.idle):
+            fresh = []
+            for conn in self.idle[key]:
+                if now - conn.last_used > self.idle_timeout:
+                    conn.close()
+                else:
+                    fresh.append(conn)
+            if fresh:
+                self.idle[key] = fresh
+            else:
+                del self.idle[key]
+
+    def idle_count(self):
+        return sum(len(conns) for conns in self.idle.values())
+
+    def evict_oldest(self):
+        key = min(self.idle, key=lambda k: self.idle[k][0].last_used)
+        self.idle[key].pop(0).close()
+        if not self.idle[key]:
+            del self.idle[key]
+
+    def close_all(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle = {}
+
+POOL = ConnectionPool()
+
+"""
+Example: a page on example.org links three stylesheets from the same host.
+    Tab.load -> URL("https://example.org/").request()
+        POOL.acquire("https", "example.org", 443)   -> no idle socket, new Connection (TCP + TLS)
+        response read up to Content-Length          -> POOL.release(conn)
+    style_url.request() for each stylesheet
+        POOL.acquire("https", "example.org", 443)   -> the same socket comes back, no new handshake
+
+If the server quietly closed the idle socket, the next request on it fails before any
+response arrives. URL.request then discards that connection and retries a GET once on a fresh one.
+"""
@@ -0,0 +1,160 @@
+import errno
+import os
+import select
+import socket
+import threading
+import time
+
+DNS_TTL = 60                # seconds a successful lookup is reused (getaddrinfo doesn't tell us the real TTL)
+NEGATIVE_TTL = 10           # seconds a failed lookup is remembered, so a typo doesn't hit the resolver on every retry
+CONNECT_DELAY = 0.25        # head start each address gets before the next one is tried (RFC 8305)
+CONNECT_TIMEOUT = 10
+
+class DNSStats:
+    def __init__(self):
+        self.lookups = 0            # real resolver calls
+        self.hits = 0               # answered from the cache
+        self.negative_hits = 0      # answered from the cache with a remembered failure
+        self.failures = 0
+        self.lookup_time = 0.0      # seconds spent inside getaddrinfo
+        self.lock = threading.Lock()
+
+    def record_lookup(self, elapsed, failed):
+        with self.lock:
+            self.lookups += 1
+            self.lookup_time += elapsed
+            if failed:
+                self.failures += 1
+
+    def record_hit(self, negative):
+        with self.lock:
+            if negative:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+
+    def hit_rate(self):
+        total = self.lookups + self.hits + self.negative_hits
+        return (self.hits + self.negative_hits) / total if total else 0.0
+
+    def average_lookup_time(self):
+        return self.lookup_time / self.lookups if self.lookups else 0.0
+
+    def snapshot(self):
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "failures": self.failures,
+            "lookup_time": self.lookup_time,
+            "average_lookup_time": self.average_lookup_time(),
+            "hit_rate": self.hit_rate(),
+        }
+
+# RFC 8305 wants the families alternated (v6, v4, v6, v4 ...), starting with
+# whichever one the system resolver preferred.
+def interleave(addresses):
+    if not addresses: return []
+    first = [a for a in addresses if a[0] == addresses[0][0]]
+    rest = [a for a in addresses if a[0] != addresses[0][0]]
+    ordered = []
+    for i in range(max(len(first), len(rest))):
+        if i < len(first): ordered.append(first[i])
+        if i < len(rest): ordered.append(rest[i])
+    return ordered
+
+class Resolver:
+    def __init__(self, ttl=DNS_TTL, negative_ttl=NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache = {}             # (host, port) -> (expires_at, addresses or the gaierror we got)
+        self.stats = DNSStats()
+        self.lock = threading.Lock()
+
+    def resolve(self, host, port):
+        key = (host, port)
+        now = time.monotonic()
+        with self.lock:
+            cached = self.cache.get(key)
+        if cached and cached[0] > now:
+            expires_at, result = cached
+            negative = isinstance(result, Exception)
+            self.stats.record_hit(negative)
+            if negative:
+                raise socket.gaierror(*result.args)
+            return result
+
+        start = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM, proto=socket.IPPROTO_TCP)
+        except socket.gaierror as e:
+            self.stats.record_lookup(time.perf_counter() - start, True)
+            with self.lock:
+                self.cache[key] = (now + self.negative_ttl, e)
+            raise
+        self.stats.record_lookup(time.perf_counter() - start, False)
+
+        addresses = interleave(addresses)
+        with self.lock:
+            self.cache[key] = (now + self.ttl, addresses)
+        return addresses
+
+    def clear(self):
+        with self.lock:
+            self.cache = {}
+
+# Start connecting to the first address; every CONNECT_DELAY without an answer (or as soon
+# as an attempt fails) start the next one as well. The first socket to connect wins.
+def happy_eyeballs_connect(addresses, delay=CONNECT_DELAY, timeout=CONNECT_TIMEOUT):
+    remaining = list(addresses)
+    pending = {}                    # socket -> address, attempts still in flight
+    last_error = None
+    deadline = time.monotonic() + timeout
+    next_start = 0
+    try:
+        while remaining or pending:
+            now = time.monotonic()
+            if now >= deadline:
+                raise socket.timeout("timed out connecting")
+
+            if remaining and (not pending or now >= next_start):
+                family, type, proto, _, sockaddr = remaining.pop(0)
+                s = socket.socket(family, type, proto)
+                s.setblocking(False)
+                err = s.connect_ex(sockaddr)
+                if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    s.close()
+                    last_error = OSError(err, os.strerror(err))
+                    continue
+                pending[s] = sockaddr
+                next_start = now + delay
+                continue
+
+            wake = min(deadline, next_start) if remaining else deadline
+            _, writable, _ = select.select([], list(pending), [], max(0, wake - now))
+            for s in writable:
+                err = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                del pending[s]
+                if err == 0:
+                    s.setblocking(True)
+                    return s
+                s.close()
+                last_error = OSError(err, os.strerror(err))
+                next_start = now        # don't wait out the delay after a failure
+        raise last_error or OSError("no addresses to connect to")
+    finally:
+        for s in pending:
+            s.close()
+
+RESOLVER = Resolver()
+
+def create_connection(host, port):
+    return happy_eyeballs_connect(RESOLVER.resolve(host, port))
+
+"""
+Example: example.org resolves to 2001:db8::1 and 93.184.216.34, but IPv6 is broken on this network
+    t=0ms    connect to [2001:db8::1]:443 (hangs)
+    t=250ms  still nothing, also connect to 93.184.216.34:443
+    t=270ms  the IPv4 socket connects and is returned; the IPv6 attempt is closed
+A second request to example.org within DNS_TTL skips getaddrinfo entirely (hits += 1).
+"""
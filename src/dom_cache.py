@@ -0,0 +1,216 @@
+import gc
+import hashlib
+import marshal
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.html_parser import HTMLParser, DOMIndex, Element, Text
+from src.http_cache import MemoryLRU
+
+DOM_CACHE_BYTES = 16 * 1024 * 1024          # serialized trees kept in memory
+DOM_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pybrowser", "dom")
+FORMAT = b"pybrowser-dom 1 marshal %d\n" % marshal.version     # first line of every file on disk
+
+# Same text, same tree: the key is a hash of the document, whatever URL it came from
+def body_key(body):
+    return hashlib.sha256(body.encode("utf8", "surrogatepass")).hexdigest()
+
+# The tree in document order as one flat list, with the page's <style> contents.
+# An element is (tag, attributes or None, number of children), a text node its str.
+# marshal keeps the interned tag and attribute names interned when it loads them back.
+def serialize(root, stylesheets):
+    flat = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Text):
+            flat.append(node.text)
+        else:
+            flat.append((node.tag, dict(node.attributes) if node.attributes else None, len(node.children)))
+            stack.extend(reversed(node.children))
+    return marshal.dumps((flat, list(stylesheets)))
+
+# Rebuilds the tree, its DOMIndex included, without tokenizing anything. Every node
+# made here lives as long as the page, so the cyclic GC is paused instead of scanning
+# them over and over while they are being created.
+def deserialize(data):
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        flat, stylesheets = marshal.loads(data)
+        return build(flat), stylesheets
+    finally:
+        if was_enabled:
+            gc.enable()
+
+def build(flat):
+    tag, attributes, count = flat[0]
+    root = Element(tag, attributes, None)
+    index = DOMIndex()
+    index.add(root)
+    register = index.register
+    root.children = []
+    parents, remaining = [root], [count]
+    for i in range(1, len(flat)):
+        while not remaining[-1]:
+            parents.pop()
+            remaining.pop()
+        remaining[-1] -= 1
+        parent = parents[-1]
+        item = flat[i]
+        if type(item) is str:
+            parent.children.append(Text(item, parent))
+        else:
+            tag, attributes, count = item
+            node = Element(tag, attributes, parent)
+            parent.children.append(node)        # the parent is complete up to here: add_child's
+            register(node)                      # work without its checks
+            if count:
+                node.children = []
+                parents.append(node)
+                remaining.append(count)
+    return root
+
+# What MemoryLRU stores: the serialized bytes, sized by their length
+class SerializedDOM:
+    def __init__(self, data):
+        self.data = data
+
+    def size(self):
+        return len(self.data)
+
+# One file per document, named by its key
+class DOMDiskStore:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        try:
+            with open(self.path(key), "rb") as f:
+                if f.readline() != FORMAT: return None      # another version wrote it
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, key, data):
+        path = self.path(key)
+        tmp = path + ".tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(FORMAT)
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            pass                        # best effort, like the HTTP cache's disk tier
+
+class DOMCacheStats:
+    def __init__(self):
+        self.hits = 0               # tree rebuilt from the cache
+        self.misses = 0             # tokenized and parsed
+        self.streamed = 0           # parsed while downloading, stored for next time
+        self.lock = threading.Lock()
+
+    # outcome is "hits", "misses" or "streamed"
+    def record(self, outcome):
+        with self.lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    # Of the documents we had to build a tree for without streaming, how many came from the cache
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def snapshot(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "streamed": self.streamed,
+            "hit_rate": self.hit_rate(),
+        }
+
+# Parsed documents by content. Pass disk_dir (e.g. DOM_CACHE_DIR) to keep them across runs.
+class DOMCache:
+    def __init__(self, memory_bytes=DOM_CACHE_BYTES, disk_dir=None):
+        self.memory = MemoryLRU(memory_bytes)
+        self.disk = DOMDiskStore(disk_dir) if disk_dir else None
+        self.stats = DOMCacheStats()
+        self.lock = threading.Lock()
+        self.writer = ThreadPoolExecutor(max_workers=1)     # runs store_later's serializing
+
+    def lookup(self, key):
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None: return entry.data
+            data = self.disk.get(key) if self.disk else None
+            if data is not None:
+                self.memory.put(key, SerializedDOM(data))
+            return data
+
+    # Serializing costs about a quarter of the parse it saves, so it is done on a
+    # background thread once the tree has been handed back to be rendered
+    def store_later(self, key, root, stylesheets):
+        with self.lock:
+            if self.memory.get(key) is not None: return     # same document again
+        self.writer.submit(self.store, key, root, stylesheets, root.index.changes)
+
+    # changes is root.index.changes when the tree was fresh from the parser. If the page
+    # changed it since (typing into an <input>), the tree no longer matches the body.
+    def store(self, key, root, stylesheets, changes=None):
+        with self.lock:
+            if self.memory.get(key) is not None: return
+        if changes is not None and root.index.changes != changes: return
+        data = serialize(root, stylesheets)
+        if changes is not None and root.index.changes != changes: return
+        with self.lock:
+            self.memory.put(key, SerializedDOM(data))
+            if self.disk:
+                self.disk.put(key, data)
+
+    # The tree for body and the contents of its <style> blocks. A sink that already
+    # parsed the body while it downloaded has its tree kept for next time; otherwise
+    # the tree comes from the cache when this exact document was seen before.
+    def parse(self, body, sink=None):
+        key = body_key(body)
+        if sink is not None and sink.complete:
+            root = sink.close(body)
+            stylesheets = sink.consumer.stylesheets
+            self.stats.record("streamed")
+            self.store_later(key, root, stylesheets)
+            return root, stylesheets
+        data = self.lookup(key)
+        if data is not None:
+            try:
+                root, stylesheets = deserialize(data)
+                self.stats.record("hits")
+                return root, stylesheets
+            except (ValueError, EOFError, TypeError, IndexError):
+                pass                    # a damaged file on disk: parse it again
+        parser = HTMLParser(body)
+        root = parser.parse()
+        self.stats.record("misses")
+        self.store_later(key, root, parser.stylesheets)
+        return root, parser.stylesheets
+
+    # Wait until every tree handed to store_later is in the cache
+    def flush(self):
+        self.writer.submit(lambda: None).result()
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+
+DOM_CACHE = DOMCache()
+
+"""
+Example: a dashboard that reloads every 5 seconds and usually returns the same 300 KB of HTML
+    1st load    streamed into HTMLParser while downloading, rendered; serialized
+                and stored meanwhile on the cache's writer thread              (streamed = 1)
+    go_back / reload, body from the HTTP cache
+                same sha256, so the tree is rebuilt from the flat list: no splitting,
+                no get_attributes, no implicit tags, no entity decoding        (hits = 1)
+    DOM_CACHE.stats.snapshot() -> {"hits": 1, "misses": 0, "streamed": 1, "hit_rate": 1.0}
+"""
@@ -1,20 +1,34 @@
 from src.url_loader import URL
+from src.scheduler import SCHEDULER, DOCUMENT, RENDER_BLOCKING_CSS
+from src.async_loader import fetch, fetch_with_url, TkAsyncBridge
+from src.prefetch import Prefetcher, PreloadScanner
+from src.request_timing import RequestLog
+from src.http_reader import TextSink
+from src.dom_cache import DOM_CACHE
+import asyncio
 import tkinter
 import urllib
 import urllib.parse
 from src.html_parser import HTMLParser, Element, Text
 from src.layout import DocumentLayout   
 from src.constants import WIDTH, HEIGHT, VSTEP, SCROLL_STEP, paint_tree, tree_to_list, get_font, DrawRect, DrawText, Rect, DrawLine, DrawOutline
-from src.styles import style, DEFAULT_STYLE_SHEET, CSSParser, cascade_priority
+from src.styles import style, DEFAULT_STYLE_SHEET, CSSParser, RuleIndex, cascade_priority
 from src.url_loader import URL
 
 class Tab:
-    def __init__(self, tab_height):
+    def __init__(self, tab_height, bridge = None):
         self.tab_height = tab_height
         self.url = None
         self.scroll = 0
         self.history = []
         self.focus = None
+        self.bridge = bridge        # TkAsyncBridge to load pages on, or None to load synchronously
+        self.loading = None         # asyncio task of the navigation in progress
+        self.document = None
+        self.layout_boxes = None    # the document's layout objects in tree order, for hit testing
+        self.display_list = []
+        self.request_log = RequestLog()     # timing of every request this tab made
+        self.prefetcher = Prefetcher(log=self.request_log, loop=bridge.loop if bridge else None)
 
     def draw(self, canvas, offset):
         for cmd in self.display_list:
@@ -22,40 +36,148 @@ class Tab:
             if cmd.bottom < self.scroll: continue
             cmd.execute(self.scroll - offset, canvas)
 
-    def load(self, url, payload = None):
-        self.history.append(url)                    # for maintaining history / tracking                                
-        self.url = url                              
-        body = url.request(payload)                        # extracts body from the url
-        self.nodes = HTMLParser(body).parse()       # a tree of nodes (texts and tags)
+    # back: this is go_back's navigation, so the current history entry goes instead of a new one coming
+    def load(self, url, payload = None, back = False):
+        prefetched = self.prefetcher.take(url) if payload is None else None
+        self.start_load(url)
+        body = sink = None
+        if prefetched is not None:
+            try:
+                url, body = prefetched.result()     # hovered earlier, already downloaded or on its way
+            except Exception:
+                pass
+        scanner = PreloadScanner(url, self.fetch_stylesheet, self.prefetcher)
+        if body is None:
+            # The worker parses the page as it downloads; the tree is ready right after the last byte,
+            # and the scanner has started the stylesheets as their <link> tags went by.
+            # url becomes the redirect target, if there was one: the page's links are relative to it
+            sink = TextSink(scanner.parser)
+            url, body = SCHEDULER.submit(
+                url, DOCUMENT, payload, owner=self,
+                action=lambda: url.request_with_url(payload, log=self.request_log, sink=sink)).result()
+        scanner.base = url
+        # a tree of nodes (texts and tags): straight from the sink, or from DOM_CACHE
+        # when this exact document was parsed before (go_back, reload)
+        nodes, inline_styles = DOM_CACHE.parse(body, sink)
+        if sink is None or not sink.complete:
+            self.send_link_hints(url, nodes)        # the scanner didn't see this document
 
-        self.rules = DEFAULT_STYLE_SHEET.copy()
-        links = [node.attributes["href"]
-                 for node in tree_to_list(self.nodes, [])
-                 if isinstance(node, Element)
-                 and node.tag == "link"
-                 and node.attributes.get("rel") == "stylesheet"
-                 and "href" in node.attributes]
-        for link in links:
-            style_url = url.resolve(link)
+        # Queue every stylesheet the scanner didn't already start, all at once so they
+        # download in parallel, then apply them in document order
+        pending = [scanner.take(style_url) or self.fetch_stylesheet(style_url)
+                   for style_url in self.stylesheet_urls(url, nodes)]
+        bodies = []
+        for future in pending:
             try:
-                body = style_url.request()
+                bodies.append(future.result())
             except:
                 continue
+        self.commit(url, nodes, back)
+        self.apply_stylesheets(bodies + inline_styles)
+
+    # Same steps as load, but the downloads are awaited on the asyncio loop
+    # that TkAsyncBridge runs, so the window keeps handling events meanwhile
+    async def load_async(self, url, payload = None, back = False):
+        prefetched = self.prefetcher.take(url) if payload is None else None
+        self.start_load(url)
+        body = sink = None
+        if prefetched is not None:
+            waiter = asyncio.wrap_future(prefetched)
+            try:
+                url, body = await asyncio.shield(waiter)
+            except asyncio.CancelledError:
+                if not waiter.cancelled(): raise    # this navigation was cancelled, not the prefetch
+            except Exception:
+                pass
+        # The parser may be fed on a transport's worker thread, so early stylesheet
+        # fetches are handed to the loop thread-safely
+        loop = asyncio.get_running_loop()
+        scanner = PreloadScanner(
+            url, lambda style_url: asyncio.run_coroutine_threadsafe(self.fetch_stylesheet_async(style_url), loop),
+            self.prefetcher)
+        if body is None:
+            sink = TextSink(scanner.parser)
+            url, body = await fetch_with_url(url, payload, log=self.request_log, sink=sink)
+        scanner.base = url
+        nodes, inline_styles = DOM_CACHE.parse(body, sink)
+        if sink is None or not sink.complete:
+            self.send_link_hints(url, nodes)
+
+        pending = []
+        for style_url in self.stylesheet_urls(url, nodes):
+            started = scanner.take(style_url)
+            pending.append(asyncio.wrap_future(started) if started else self.fetch_stylesheet_async(style_url))
+        results = await asyncio.gather(*pending, return_exceptions=True)
+        self.commit(url, nodes, back)
+        self.apply_stylesheets([r for r in results if not isinstance(r, BaseException)] + inline_styles)
+
+    # Entry point for user navigation: asynchronous when the tab has a bridge to run on
+    def navigate(self, url, payload = None, back = False):
+        if self.bridge is None:
+            return self.load(url, payload, back)
+        if self.loading:
+            self.loading.cancel()                   # a newer navigation wins
+        self.loading = self.bridge.run(self.load_async(url, payload, back))
+
+    def start_load(self, url):
+        SCHEDULER.cancel(self)                      # drop whatever the previous page still had queued
+        self.prefetcher.reset()
+
+    # The new document replaces the old one. Until now the old page, its URL and its
+    # history entry stayed as they were, so its links still resolve against its own URL,
+    # and a load that fails leaves no trace in the history.
+    def commit(self, url, nodes, back = False):
+        if back:
+            self.history.pop()                      # back to the page before, which is now the last entry
+        else:
+            self.history.append(url)                # for maintaining history / tracking
+        self.url = url
+        self.nodes = nodes
+        self.focus = None                           # the focused input belonged to the old page
+
+    def fetch_stylesheet(self, style_url):
+        return SCHEDULER.submit(style_url, RENDER_BLOCKING_CSS, owner=self, log=self.request_log)
+
+    def fetch_stylesheet_async(self, style_url):
+        return fetch(style_url, log=self.request_log, priority=RENDER_BLOCKING_CSS)
+
+    def stylesheet_urls(self, base, nodes):
+        links = [node.attributes["href"]
+                 for node in nodes.index.elements("link")
+                 if node.attributes.get("rel") == "stylesheet"
+                 and "href" in node.attributes]
+        urls = [base.resolve(link) for link in links]
+        return [url for url in urls if url is not None]
+
+    # <link rel=preconnect|prefetch|preload> hints go to the prefetcher
+    def send_link_hints(self, base, nodes):
+        for node in nodes.index.elements("link"):
+            rel = node.attributes.get("rel", "").casefold()
+            if rel not in ("preconnect", "prefetch", "preload"): continue
+            url = base.resolve(node.attributes.get("href"))
+            if url is not None:
+                self.prefetcher.hint(rel, url)
+
+    # Linked sheets first, then the page's own <style> blocks (HTMLParser.stylesheets)
+    def apply_stylesheets(self, bodies):
+        self.rules = DEFAULT_STYLE_SHEET.copy()
+        for body in bodies:
             self.rules.extend(CSSParser(body).parse())
+        self.rule_index = RuleIndex(sorted(self.rules, key=cascade_priority))   # reused by every render
 
-        style(self.nodes, sorted(self.rules, key=cascade_priority))
+        style(self.nodes, self.rule_index)
 
         self.document = DocumentLayout(self.nodes)
         self.document.layout()
+        self.layout_boxes = None
         self.display_list = []
         
         paint_tree(self.document, self.display_list)
         self.render()
     
     def submit_form(self, elt):
-        inputs = [node for node in tree_to_list(elt, [])
-                  if isinstance(node, Element)
-                  and node.tag == "input"
+        inputs = [node for node in elt.index.controls(elt)
+                  if node.tag == "input"
                   and "name" in node.attributes]
         body = ""
         for input in inputs:
@@ -68,22 +190,23 @@ class Tab:
         # body has an extra "&" tucked in the beginning
         body = body[1:]  
         url = self.url.resolve(elt.attributes["action"])  
-        self.load(url, body)                             
+        if url is None: return
+        self.navigate(url, body)                             
     
     def render(self):
-        style(self.nodes, sorted(self.rules, key=cascade_priority)) # seperate styles from tags
+        style(self.nodes, self.rule_index)  # seperate styles from tags
         self.document = DocumentLayout(self.nodes)
         self.document.layout()
+        self.layout_boxes = None
         self.display_list = []
         paint_tree(self.document, self.display_list)
 
     def go_back(self):
         if len(self.history) > 1:
-            self.history.pop()
-            back = self.history.pop()
-            self.load(back)
+            self.navigate(self.history[-2], back=True)  # commit drops the current entry once it loads
 
     def scrolldown(self):
+        if self.document is None: return
         max_y = max(self.document.height + 2*VSTEP - self.tab_height, 0)
         self.scroll = min(self.scroll + SCROLL_STEP, max_y)
     
@@ -92,26 +215,50 @@ class Tab:
 
     def keypress(self, char):
         if self.focus:
-            self.focus.attributes["value"] += char
+            self.focus.set_attribute("value", self.focus.attributes.get("value", "") + char)
             self.render()
 
-    def click(self, x, y):
+    # Deepest DOM node whose layout box contains the point, or None. Hover asks on every
+    # pointer move, so the layout tree is flattened once per layout rather than per call.
+    def node_at(self, x, y):
+        if self.document is None: return None
+        if self.layout_boxes is None:
+            self.layout_boxes = tree_to_list(self.document, [])
         y += self.scroll
-        objs = [obj for obj in tree_to_list(self.document, [])
-                if obj.x <= x < obj.x + obj.width
-                and obj.y <= y < obj.y + obj.height]
-        if not objs: return
+        for obj in reversed(self.layout_boxes):
+            if obj.x <= x < obj.x + obj.width and obj.y <= y < obj.y + obj.height:
+                return obj.node
+        return None
 
-        elt = objs[-1].node
+    # Link under the pointer, found the same way click finds it
+    def link_at(self, x, y):
+        elt = self.node_at(x, y)
+        while elt:
+            if isinstance(elt, Element) and elt.tag == "a" and "href" in elt.attributes:
+                return self.url.resolve(elt.attributes["href"]) if self.url else None
+            elt = elt.parent
+        return None
+
+    # Pointer moved: warm up whatever link it now rests on (None when it left the page)
+    def hover(self, x, y):
+        if x is None:
+            self.prefetcher.leave()
+        else:
+            self.prefetcher.hover(self.link_at(x, y))
+
+    def click(self, x, y):
+        elt = self.node_at(x, y)
+        if elt is None: return
         while elt:
             if isinstance(elt, Text):
                 pass
             elif elt.tag == "a" and "href" in elt.attributes:
                 if self.url is not None:
                     url = self.url.resolve(elt.attributes["href"])
-                    return self.load(url)
+                    if url is None: return      # "#top", "javascript:", mailto: ...
+                    return self.navigate(url)
             elif elt.tag == "input":
-                elt.attributes["value"] = ""
+                elt.set_attribute("value", "")
                 if self.focus:
                     self.focus.is_focused = False
                 self.focus = elt
@@ -140,15 +287,18 @@ class Browser:
         self.window.bind("<Button-1>", self.handle_click)
         self.window.bind("<Key>", self.handle_key)
         self.window.bind("<Return>", self.handle_enter)
+        self.window.bind("<Motion>", self.handle_motion)
+        self.window.bind("<Leave>", self.handle_leave)
 
         self.tabs = []
         self.active_tab = None
         self.chrome = Chrome(self)
+        self.bridge = TkAsyncBridge(self.window, on_done=self.draw)    # page loads run on asyncio
 
     # creates a new tab 
     def new_tab(self, url):
-        new_tab = Tab(HEIGHT - self.chrome.bottom)  # Initializes "Tab" class
-        new_tab.load(url)                           # loads the url using Tab's load method
+        new_tab = Tab(HEIGHT - self.chrome.bottom, self.bridge)    # Initializes "Tab" class
+        new_tab.navigate(url)                       # starts loading the url in the background
 
         self.active_tab = new_tab                  
         self.tabs.append(new_tab)                   # for maintaining multiple tabs
@@ -179,6 +329,17 @@ class Browser:
             self.active_tab.click(e.x, tab_y)
         self.draw()
     
+    def handle_motion(self, e):
+        if not self.active_tab: return
+        if e.y < self.chrome.bottom:
+            self.active_tab.hover(None, None)
+        else:
+            self.active_tab.hover(e.x, e.y - self.chrome.bottom)
+
+    def handle_leave(self, e):
+        if self.active_tab:
+            self.active_tab.hover(None, None)
+
     def handle_key(self, e):
         if len(e.char) == 0: return
         if not (0x20 <= ord(e.char) < 0x7f): return
@@ -350,7 +511,7 @@ class Chrome:
 
     def enter(self):
         if self.focus == "address bar":
-            self.browser.active_tab.load(URL(self.address_bar))
+            self.browser.active_tab.navigate(URL(self.address_bar))
             self.focus = None
 
     def tab_rect(self, i):
@@ -1,26 +1,212 @@
+import html
+import re
+import sys
+import types
+
+TAG_DELIMITER = re.compile("([<>])")     # the group keeps the delimiters in split()'s output
+
+# <script> and <style> hold raw text: no tags, no entities, up to the matching end tag
+RAW_TEXT_START = re.compile(r"<(?:script|style)[\s/>]", re.IGNORECASE)
+RAW_TEXT_ENDS = {
+    "script": re.compile(r"</script[\s/>]", re.IGNORECASE),
+    "style": re.compile(r"</style[\s/>]", re.IGNORECASE),
+}
+
+# Shared by every node that has nothing of its own yet. Read-only, so nobody can
+# fill them in for all nodes at once by accident: add_child / set_attribute / style() replace them.
+EMPTY_CHILDREN = ()
+EMPTY_ATTRIBUTES = types.MappingProxyType({})
+EMPTY_STYLE = types.MappingProxyType({})
+
+# Nodes use __slots__: no per-node __dict__, which is most of what a small object costs.
+# A page can have hundreds of thousands of them.
 class Text:
+    __slots__ = ("text", "parent", "style")
+    children = EMPTY_CHILDREN   # text nodes dont have children, but kept for consistency
+    is_focused = False          # only inputs get focus
+
     def __init__(self, text, parent):
         self.text = text
-        self.children = [] # text nodes dont have children, but kept for consistency
         self.parent = parent
-        self.style = {}
-        self.is_focused = False
+        self.style = EMPTY_STYLE        # style() points this at the parent's inherited properties
 
     def __repr__(self):
         return repr(self.text)
 
 class Element:
+    __slots__ = ("tag", "attributes", "children", "parent", "style", "is_focused", "index")
+
     def __init__(self, tag, attributes, parent):
         self.tag = tag                  # tag name, e.g., "div", "body", "html" etc
-        self.attributes = attributes    # dictionary of html attributes
-        self.children = []              # list of children, element or text
+        self.attributes = attributes or EMPTY_ATTRIBUTES    # dictionary of html attributes
+        self.children = EMPTY_CHILDREN  # list of children, element or text (a real list from the first one on)
         self.parent = parent            # pointer to parent element
-        self.style = {}
+        self.style = EMPTY_STYLE        # filled in by style()
         self.is_focused = False
+        self.index = None               # the DOMIndex of the document this element is in
+
+    # Changes to the tree and to indexed attributes go through these methods,
+    # so the document's DOMIndex stays in step with it
+    def add_child(self, node):
+        node.parent = self
+        if self.children is EMPTY_CHILDREN:
+            self.children = [node]
+        else:
+            self.children.append(node)
+        if self.index is not None:
+            self.index.changes += 1
+            if not isinstance(node, Element): return
+            if node.children:
+                self.index.add(node)
+            else:
+                self.index.register(node)       # what the parser does: nothing below it yet
+
+    def remove_child(self, node):
+        self.children.remove(node)
+        if self.index is not None:
+            self.index.changes += 1
+            if isinstance(node, Element):
+                self.index.remove(node)
+        node.parent = None
+
+    def set_attribute(self, name, value):
+        if self.attributes is EMPTY_ATTRIBUTES:
+            self.attributes = {}
+        if self.index is not None:
+            self.index.changes += 1
+        if self.index is None or name not in DOMIndex.ATTRIBUTES:
+            self.attributes[name] = value
+            return
+        self.index.unregister_attributes(self)
+        self.attributes[name] = value
+        self.index.register_attributes(self)
+
+    def remove_attribute(self, name):
+        if name not in self.attributes: return
+        if self.index is not None:
+            self.index.changes += 1
+        if self.index is not None and name in DOMIndex.ATTRIBUTES:
+            self.index.unregister_attributes(self)
+            del self.attributes[name]
+            self.index.register_attributes(self)
+        else:
+            del self.attributes[name]
 
     def __repr__(self):
         return "<" + self.tag + ">"
 
+# Lookups into one document without walking it: elements by tag, id and class,
+# the controls of each form, and the elements that load something. Filled in while
+# the parser builds the tree, kept up to date by Element's mutation methods.
+# Every table keeps elements in the order they were added (dicts used as ordered sets):
+# document order for parsed nodes, nodes added later come after them.
+class DOMIndex:
+    CONTROLS = {"input", "button", "select", "textarea"}
+    # tag -> the attribute with the URL it loads
+    RESOURCES = {
+        "link": "href", "script": "src", "img": "src", "iframe": "src",
+        "embed": "src", "source": "src", "video": "src", "audio": "src",
+    }
+    ATTRIBUTES = {"id", "class", "href", "src"}     # attributes the tables depend on
+
+    def __init__(self):
+        self.tags = {}          # tag -> {element: None}
+        self.ids = {}           # id -> {element: None}
+        self.classes = {}       # class name -> {element: None}
+        self.forms = {}         # <form> element -> {control: None}
+        self.resources = {}     # {element: None}: <link href>, <img src>, <script src>, ...
+        self.changes = 0        # bumped by every change made through Element's methods
+
+    # node and everything below it joined the document
+    def add(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if not isinstance(node, Element): continue
+            self.register(node)
+            stack.extend(reversed(node.children))   # keep document order
+
+    # node and everything below it left the document
+    def remove(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if not isinstance(node, Element): continue
+            self.unregister(node)
+            stack.extend(node.children)
+
+    def register(self, node):
+        node.index = self
+        bucket = self.tags.get(node.tag)
+        if bucket is None:
+            bucket = self.tags[node.tag] = {}
+        bucket[node] = None
+        if node.attributes:             # most elements have none
+            self.register_attributes(node)
+        if node.tag in self.CONTROLS:
+            form = self.form_of(node)
+            if form is not None:
+                self.forms.setdefault(form, {})[node] = None
+
+    def unregister(self, node):
+        discard(self.tags, node.tag, node)
+        self.unregister_attributes(node)
+        if node.tag == "form":
+            self.forms.pop(node, None)
+        elif node.tag in self.CONTROLS:
+            form = self.form_of(node)
+            if form is not None:
+                discard(self.forms, form, node)
+        node.index = None
+
+    def register_attributes(self, node):
+        attributes = node.attributes
+        if "id" in attributes:
+            self.ids.setdefault(attributes["id"], {})[node] = None
+        for name in attributes.get("class", "").split():
+            self.classes.setdefault(name, {})[node] = None
+        if self.RESOURCES.get(node.tag) in attributes:
+            self.resources[node] = None
+
+    def unregister_attributes(self, node):
+        attributes = node.attributes
+        if "id" in attributes:
+            discard(self.ids, attributes["id"], node)
+        for name in attributes.get("class", "").split():
+            discard(self.classes, name, node)
+        self.resources.pop(node, None)
+
+    # Nearest <form> around a control
+    @staticmethod
+    def form_of(node):
+        node = node.parent
+        while node is not None and node.tag != "form":
+            node = node.parent
+        return node
+
+    def elements(self, tag):
+        return list(self.tags.get(tag, ()))
+
+    def element_by_id(self, id):
+        return next(iter(self.ids.get(id, ())), None)
+
+    def elements_with_class(self, name):
+        return list(self.classes.get(name, ()))
+
+    def controls(self, form):
+        return list(self.forms.get(form, ()))
+
+    def resource_elements(self):
+        return list(self.resources)
+
+# Take node out of table[key], and the key with it once nothing is left
+def discard(table, key, node):
+    bucket = table.get(key)
+    if bucket is None: return
+    bucket.pop(node, None)
+    if not bucket:
+        del table[key]
+
 def print_tree(node, indent=0):
     print(" " * indent, node)           # print the current node with indentation
     for child in node.children:
@@ -35,41 +221,152 @@ class HTMLParser:
         "base", "basefont", "bgsound", "noscript",
         "link", "meta", "title", "style", "script",
     ]
+    # Start tags that end an open <p> first, as in the spec's "in body" insertion mode
+    CLOSES_P = {
+        "address", "article", "aside", "blockquote", "details", "dialog", "div", "dl",
+        "dd", "dt", "fieldset", "figcaption", "figure", "footer", "form",
+        "h1", "h2", "h3", "h4", "h5", "h6", "header", "hgroup", "hr", "li",
+        "main", "menu", "nav", "ol", "p", "pre", "section", "summary", "table", "ul",
+    }
+    # <li> ends an open <li>, <dt> / <dd> end an open <dt> or <dd>, unless a list in between
+    # makes the new one a nested item: tag -> (what it closes, where the search stops)
+    CLOSES_ITEM = {
+        "li": ({"li"}, {"ul", "ol"}),
+        "dt": ({"dt", "dd"}, {"dl"}),
+        "dd": ({"dt", "dd"}, {"dl"}),
+    }
+    # Elements an implicit close never reaches past (the spec's "scope" boundaries)
+    SCOPE_BOUNDARIES = {
+        "html", "table", "td", "th", "caption", "button", "object", "marquee", "applet", "template",
+    }
 
-    def __init__(self, body):
+    # Insertion modes: which part of the <html><head>...</head><body> skeleton we are in
+    INITIAL = "initial"             # nothing yet, not even <html>
+    BEFORE_HEAD = "before head"     # <html> open, no <head> or <body> yet
+    IN_HEAD = "in head"             # <head> open
+    AFTER_HEAD = "after head"       # </head> seen, no <body> yet
+    IN_BODY = "in body"             # <body> open; it stays open until the end
+
+    def __init__(self, body="", preload=None):
         self.body = body                # raw html as string
+        self.preload = preload          # called with every element that loads something (DOMIndex.RESOURCES), as soon as it is parsed
         self.unfinished = []            # stack of open (unfinished) elements
+        self.pending = []               # fed text not yet followed by a "<" or ">", so not a token yet
+        self.in_tag = False             # whether pending is the inside of a tag
+        self.root = None                # the <html> element, as soon as it exists
+        self.mode = self.INITIAL
+        self.open_counts = {}           # tag -> how many elements with that tag are in unfinished
+        self.raw_text = None            # the <script> / <style> whose content is being read
+        self.stylesheets = []           # contents of every <style>, in document order
+        self.index = DOMIndex()         # filled in as elements are added to the tree
 
-    # seperates tags from text
+    # seperates tags from text, all in one go
     def parse(self):
-        text = ""
-        in_tag = False
-        for c in self.body:
-            if c == "<":
+        self.feed(self.body)
+        return self.close()
+
+    # Incremental version: hand over the document a piece at a time, as it downloads.
+    # The tree grows as complete tokens arrive; whatever comes after the last "<" or ">"
+    # of a chunk (half a tag, or text that may go on) waits in pending for the next one.
+    def feed(self, chunk):
+        if self.raw_text is not None:
+            if not self.raw_text_ends(chunk):
+                self.pending.append(chunk)  # the script goes on, nothing to look at yet
+                return
+        elif not TAG_DELIMITER.search(chunk):
+            self.pending.append(chunk)      # no token ends in here, don't re-split what we have
+            return
+        if self.pending:
+            self.pending.append(chunk)
+            chunk = "".join(self.pending)
+            self.pending = []
+        # Markup is tokenized up to the next <script> / <style>; its content is one
+        # search for the end tag, then tokenizing picks up again from there
+        start = 0
+        while True:
+            if self.raw_text is not None:
+                end = RAW_TEXT_ENDS[self.raw_text.tag].search(chunk, start)
+                if not end:
+                    self.pending = [chunk[start:]] if start < len(chunk) else []
+                    return
+                self.end_raw_text(chunk[start:end.start()])
+                start = end.start()
+            raw = RAW_TEXT_START.search(chunk, start)
+            stop = chunk.find(">", raw.start()) + 1 if raw else 0
+            if not stop: stop = len(chunk)
+            start += self.tokenize(chunk[start:stop] if start or stop < len(chunk) else chunk)
+            if start == len(chunk) and self.raw_text is None:
+                return
+
+    # Splits markup into tokens and adds them to the tree. The piece after the last "<"
+    # or ">" stays pending. Returns how much of text was used: all of it, unless a
+    # <script> / <style> opened early and the rest is raw text.
+    def tokenize(self, text):
+        pieces = TAG_DELIMITER.split(text)      # text, delimiter, text, delimiter, ..., text
+        add_text, add_tag = self.add_text, self.add_tag
+        in_tag = self.in_tag
+        for i in range(1, len(pieces), 2):
+            piece = pieces[i - 1]
+            if pieces[i] == "<":
                 in_tag = True
-                if text: self.add_text(text)
-                text = ""
-            elif c == ">":
-                in_tag = False
-                self.add_tag(text)
-                text = ""
+                if piece: add_text(piece)
             else:
-                text += c
-        if not in_tag and text:
+                in_tag = False
+                add_tag(piece)
+                if self.raw_text is not None:
+                    self.in_tag = False
+                    return sum(map(len, pieces[:i + 1]))
+        self.in_tag = in_tag
+        self.pending = [pieces[-1]] if pieces[-1] else []
+        return len(text)
+
+    # Whether the end tag of the open raw text element can be in what we have now.
+    # Only the tail of pending matters: the end tag may have been cut in two.
+    def raw_text_ends(self, chunk):
+        if not self.pending:
+            return RAW_TEXT_ENDS[self.raw_text.tag].search(chunk) is not None
+        keep = len(self.raw_text.tag) + 2       # "</script"
+        tail = "".join(self.pending[-keep:])[-keep:]
+        return RAW_TEXT_ENDS[self.raw_text.tag].search(tail + chunk) is not None
+
+    def end_raw_text(self, text):
+        node, self.raw_text = self.raw_text, None
+        if not text or text.isspace(): return
+        node.add_child(Text(text, node))        # as is: "a < b && c" stays that
+        if node.tag == "style":
+            self.stylesheets.append(text)
+
+    # End of the document: flush trailing text and close whatever is still open
+    def close(self):
+        text = "".join(self.pending)
+        self.pending = []
+        if self.raw_text is not None:
+            self.end_raw_text(text)         # a <script> that never ends runs to the end
+        elif not self.in_tag and text:
             self.add_text(text)
         return self.finish()
     """
     Example input = <html><body>Hello World!</body></html>
-    char        in_tag      action
-     <          True        add_text() --> clean text to ""
-     >          False       add_tag() --> clean text to ""
-     other      False       add to text
+    pieces = ["", "<", "html", ">", "", "<", "body", ">", "Hello World!", "<", "/body", ">", ...]
+    delimiter   in_tag      action
+     <          True        add_text(the piece before it, if not empty)
+     >          False       add_tag(the piece before it)
+
+    Fed in two chunks, "<html><bo" and "dy>Hello Wor" + "ld!</body></html>":
+     1st feed   <html> is added, "bo" waits in pending (in_tag = True)
+     2nd feed   pending + chunk -> <body> is added, "Hello Wor" waits (it may go on)
+     3rd feed   "Hello World!" is added whole, so an entity like "&amp;" can never be cut in two
+
+    With a script, "<p>a</p><script>if (i < n) x()</script><p>b":
+     "<p>a</p><script>" is tokenized, one search finds "</script", "if (i < n) x()" becomes
+     the script's only Text (not an <n> element), and tokenizing resumes at "</script>"
     """
 
     # Seperate tag name from attribute
     def get_attributes(self, text):
         parts = text.split()
-        tag = parts[0].casefold()
+        tag = sys.intern(parts[0].casefold())          # every <p> shares one "p"
+        if len(parts) == 1: return tag, EMPTY_ATTRIBUTES   # most tags: <p>, </div>, <br>
         attributes = {}
 
         for attrpair in parts[1:]:
@@ -77,9 +374,10 @@ class HTMLParser:
                 key, value = attrpair.split("=", 1)
                 if len(value) > 2 and value[0] in ["'", "/"]:
                     value = value[1:-1]
-                attributes[key.casefold()] = value
+                if "&" in value: value = html.unescape(value)     # href="?a=1&amp;b=2"
+                attributes[sys.intern(key.casefold())] = value
             else: 
-                attributes[attrpair.casefold()] = ""
+                attributes[sys.intern(attrpair.casefold())] = ""
         return tag, attributes
     """
     Example input: <a href="https://example.org" target="_blank">
@@ -93,47 +391,107 @@ class HTMLParser:
     def add_text(self, text):
         if text.isspace(): return
         self.implicit_tags(None)        # ensure basic doc structure
+        if "&" in text: text = html.unescape(text)      # &lt; &amp; &nbsp; &#8212; ...
 
         parent = self.unfinished[-1]    # parent is most recent unfinished tag
         node = Text(text, parent)       # create new Text node instance with reference to its parent element
-        parent.children.append(node)    # append the current children to parent's list of children
+        parent.add_child(node)          # append the current children to parent's list of children
 
     def add_tag (self, tag):
+        if not tag or tag.isspace(): return         # "<>", or a stray ">" right after a tag
         tag, attributes = self.get_attributes(tag)  # seperate tag name from its attributes
         if tag.startswith("!"): return              # to ignore comments (<!-- -->) or doctype (<!DOCTYPE>) tags
         self.implicit_tags(tag)                     # ensure basic doc structure
 
-        # Close tag finishes the last unfinished node by adding it to the prev unfinished node in list
+        # Close tag finishes the matching unfinished node (and anything left open inside it).
+        # Nodes already sit in their parent's children (added when they opened),
+        # so a tree that is still being fed can be looked at.
         if tag.startswith("/"): 
-            if len(self.unfinished) == 1: return    # to prevent stack overflow / malformed tree, as its likely root node
-            node = self.unfinished.pop()            # pop most recent unfinished tag as node
-            parent = self.unfinished[-1]            # the new last item in unfinished tags is current node's parent
-            parent.children.append(node)            # add current node to the list of children of it's parent
+            self.end_tag(tag[1:])
+            return
+
+        self.implicit_closes(tag)                   # <p>a<p>b, <li>a<li>b: the first one ends here
 
         # Handle self closing tags (e.g., <br>, <hr>, <img>)
-        elif tag in self.SELF_CLOSING_TAGS:
+        if tag in self.SELF_CLOSING_TAGS:
             parent = self.unfinished[-1]                # current tag's parent is the recent-most unfinished tag    
             node = Element(tag, attributes, parent)     # create a new Element node instance with reference to its attributes and parent
-            parent.children.append(node)                # add current node to it's parents list of children
+            parent.add_child(node)                      # add current node to it's parents list of children
 
         # Open tags adds an unfinished node to the end of the list
         else:   
             parent = self.unfinished[-1] if self.unfinished else None   # current tag's parent is recent-most unfinished tag if unfinished tag exists, 
             node = Element(tag, attributes, parent)                     # create new Element node instance with reference to its attributes and parent
-            self.unfinished.append(node)                                # add it to unfinished tags list
+            if parent is not None:
+                parent.add_child(node)                                  # in document order, right away
+            elif self.root is None:
+                self.root = node
+                self.index.add(node)                                    # its children join through add_child
+            self.push(node)                                             # add it to unfinished tags list
+            if tag in RAW_TEXT_ENDS:
+                self.raw_text = node                                    # what follows is its content, not markup
+
+        if self.preload is not None and tag in DOMIndex.RESOURCES:
+            self.preload(node)                                          # e.g. start a stylesheet before the rest has even arrived
+
+    def push(self, node):
+        depth = len(self.unfinished)
+        self.unfinished.append(node)
+        self.open_counts[node.tag] = self.open_counts.get(node.tag, 0) + 1
+        # Only the skeleton moves the mode along
+        if depth == 0:
+            self.mode = self.BEFORE_HEAD
+        elif depth == 1 and node.tag == "head":
+            self.mode = self.IN_HEAD
+        elif depth == 1 and node.tag == "body":
+            self.mode = self.IN_BODY
+
+    def pop(self):
+        node = self.unfinished.pop()
+        self.open_counts[node.tag] -= 1
+        if node.tag == "head" and len(self.unfinished) == 1:
+            self.mode = self.AFTER_HEAD
+        return node
+
+    def end_tag(self, tag):
+        if tag in ("html", "body"): return          # stay in <body>; finish() closes both
+        if not self.open_counts.get(tag): return    # nothing open to close: a stray end tag
+        while self.pop().tag != tag: pass
+
+    # Close the innermost open element named in names, with everything opened inside it,
+    # unless one of stops (or a scope boundary) comes first. Nothing to look for: O(1).
+    def close_in_scope(self, names, stops=()):
+        if not any(self.open_counts.get(name) for name in names): return
+        for i in range(len(self.unfinished) - 1, 0, -1):
+            tag = self.unfinished[i].tag
+            if tag in names:
+                while len(self.unfinished) > i:
+                    self.pop()
+                return
+            if tag in stops or tag in self.SCOPE_BOUNDARIES:
+                return
+
+    def implicit_closes(self, tag):
+        if tag in self.CLOSES_ITEM:
+            self.close_in_scope(*self.CLOSES_ITEM[tag])
+        if tag in self.CLOSES_P:
+            self.close_in_scope(("p",))
 
-    # Ensures minimal basic HTML structure exists in document.
+    # Ensures minimal basic HTML structure exists in document. The mode says where in
+    # the skeleton we are, so this is a constant amount of work however deep the tree is.
     def implicit_tags(self, tag): 
         while True:
-            open_tags = [node.tag for node in self.unfinished]
-            if open_tags == [] and tag != "html":
+            if self.mode == self.IN_BODY: break
+            if self.mode == self.INITIAL and tag != "html":
                 self.add_tag("html")
-            elif open_tags == ["html"] and tag not in ["head", "body", "/html"]:
+            elif self.mode in (self.BEFORE_HEAD, self.AFTER_HEAD) and len(self.unfinished) == 1 \
+                    and tag not in ["head", "body", "/html"]:
                 if tag in self.HEAD_TAGS:
                     self.add_tag("head")
                 else:
                     self.add_tag("body")
-            elif open_tags == ["html", "head"] and tag not in ["/head"] + self.HEAD_TAGS:
+            elif self.mode == self.IN_HEAD and len(self.unfinished) == 2 \
+                    and tag not in ["/head"] + self.HEAD_TAGS:
                 self.add_tag("/head")
             else:
                 break
@@ -143,12 +501,10 @@ class HTMLParser:
         if not self.unfinished:
             self.implicit_tags(None)
 
-        # if there are unfinished tags (except root node), finish them.
-        while len(self.unfinished) > 1:
-            node = self.unfinished.pop()
-            parent = self.unfinished[-1]
-            parent.children.append(node)
+        # if there are unfinished tags, finish them (they are in the tree already)
+        root = self.unfinished[0]
+        self.unfinished = []
         
         # return top level root node
-        return self.unfinished.pop()
+        return root
     
\ No newline at end of file
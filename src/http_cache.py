@@ -0,0 +1,298 @@
+import email.utils
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+MEMORY_CACHE_BYTES = 32 * 1024 * 1024      # body bytes kept in the in-memory LRU
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pybrowser", "http")
+CACHEABLE_STATUSES = [200, 203, 300, 301, 308, 404, 410]
+
+# "max-age=60, no-cache" -> {"max-age": "60", "no-cache": None}
+def parse_cache_control(value):
+    directives = {}
+    for part in value.split(","):
+        part = part.strip()
+        if not part: continue
+        if "=" in part:
+            name, arg = part.split("=", 1)
+            directives[name.strip().casefold()] = arg.strip().strip('"')
+        else:
+            directives[part.casefold()] = None
+    return directives
+
+def parse_http_date(value):
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+class CacheEntry:
+    def __init__(self, url, status, headers, body, stored_at=None):
+        self.url = url
+        self.status = status
+        self.headers = headers          # casefolded names, as URL.request builds them
+        self.body = body                # bytes, already un-gzipped
+        self.stored_at = stored_at if stored_at is not None else time.time()
+
+    def cache_control(self):
+        return parse_cache_control(self.headers.get("cache-control", ""))
+
+    # How long after it was stored the response may be used without asking the server
+    def freshness_lifetime(self):
+        directives = self.cache_control()
+        if "no-cache" in directives: return 0
+        if "max-age" in directives:
+            try:
+                return max(0, int(directives["max-age"]))
+            except ValueError:
+                return 0
+        if "expires" in self.headers:
+            expires = parse_http_date(self.headers["expires"])
+            if expires is None: return 0
+            date = parse_http_date(self.headers.get("date", "")) or self.stored_at
+            return max(0, expires - date)
+        return 0
+
+    # Age when stored (from the Age header) plus time spent in our cache
+    def current_age(self, now=None):
+        now = now if now is not None else time.time()
+        try:
+            initial_age = int(self.headers.get("age", "0"))
+        except ValueError:
+            initial_age = 0
+        return initial_age + max(0, now - self.stored_at)
+
+    def is_fresh(self, now=None):
+        return self.current_age(now) < self.freshness_lifetime()
+
+    def has_validators(self):
+        return "etag" in self.headers or "last-modified" in self.headers
+
+    # Headers that turn a GET into "send the body only if it changed"
+    def conditional_headers(self):
+        headers = {}
+        if "etag" in self.headers:
+            headers["If-None-Match"] = self.headers["etag"]
+        if "last-modified" in self.headers:
+            headers["If-Modified-Since"] = self.headers["last-modified"]
+        return headers
+
+    def size(self):
+        return len(self.body)
+
+    def to_json(self):
+        return json.dumps({
+            "url": self.url,
+            "status": self.status,
+            "headers": self.headers,
+            "stored_at": self.stored_at,
+        })
+
+    @classmethod
+    def from_json(cls, meta, body):
+        meta = json.loads(meta)
+        return cls(meta["url"], meta["status"], meta["headers"], body, meta["stored_at"])
+
+class MemoryLRU:
+    def __init__(self, max_bytes=MEMORY_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()    # key -> CacheEntry, least recently used first
+        self.bytes = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.remove(key)
+        if entry.size() > self.max_bytes: return    # would evict everything else; leave it to the disk tier
+        self.entries[key] = entry
+        self.bytes += entry.size()
+        while self.bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= evicted.size()
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size()
+
+    def clear(self):
+        self.entries = OrderedDict()
+        self.bytes = 0
+
+# One file per URL: a line of JSON metadata followed by the raw body bytes
+class DiskStore:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf8")).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self.path(key), "rb") as f:
+                meta = f.readline()
+                body = f.read()
+            entry = CacheEntry.from_json(meta.decode("utf8"), body)
+        except (OSError, ValueError, KeyError):
+            return None
+        return entry if entry.url == key else None     # sha256 collision, or a stale file
+
+    def put(self, key, entry):
+        path = self.path(key)
+        tmp = path + ".tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(entry.to_json().encode("utf8") + b"\n")
+                f.write(entry.body)
+            os.replace(tmp, path)       # readers never see a half-written file
+        except OSError:
+            pass                        # the disk tier is best effort
+
+    def remove(self, key):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0               # served fresh from the cache, no network at all
+        self.revalidated = 0        # server answered 304, body came from the cache
+        self.misses = 0             # full response downloaded
+        self.stores = 0
+        self.lock = threading.Lock()
+
+    # outcome is "hits", "revalidated", "misses" or "stores"
+    def record(self, outcome):
+        with self.lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def hit_rate(self):
+        total = self.hits + self.revalidated + self.misses
+        return (self.hits + self.revalidated) / total if total else 0.0
+
+    def snapshot(self):
+        return {
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": self.hit_rate(),
+        }
+
+class HTTPCache:
+    def __init__(self, memory_bytes=MEMORY_CACHE_BYTES, disk_dir=CACHE_DIR):
+        self.memory = MemoryLRU(memory_bytes)
+        self.disk = DiskStore(disk_dir) if disk_dir else None
+        self.stats = CacheStats()
+        self.lock = threading.Lock()
+
+    # Memory first, then disk (promoting what we find there back into memory)
+    def lookup(self, key):
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is None and self.disk:
+                entry = self.disk.get(key)
+                if entry is not None:
+                    self.memory.put(key, entry)
+            return entry
+
+    # The entry a request should start from: only GETs use the cache
+    def lookup_fresh(self, key, method):
+        if method != "GET": return None
+        entry = self.lookup(key)
+        if entry and entry.is_fresh():
+            self.stats.record("hits")
+        return entry
+
+    def conditional_headers(self, entry):
+        if entry and entry.has_validators():
+            return entry.conditional_headers()
+        return {}
+
+    # Fold the server's answer into the cache and return the status, headers and body the caller should see
+    def complete(self, key, method, entry, status, headers, body):
+        if method != "GET":
+            self.invalidate(key)        # a POST may change what a GET of this URL returns
+            return status, headers, body
+        if status == 304 and entry:
+            self.stats.record("revalidated")
+            entry = self.freshen(key, entry, headers)
+            return entry.status, entry.headers, entry.body
+        self.stats.record("misses")
+        self.store(key, status, headers, body)
+        return status, headers, body
+
+    def store(self, key, status, headers, body):
+        directives = parse_cache_control(headers.get("cache-control", ""))
+        if "no-store" in directives or headers.get("vary", "").strip() == "*":
+            self.invalidate(key)
+            return None
+        if status not in CACHEABLE_STATUSES: return None
+
+        entry = CacheEntry(key, status, headers, body)
+        # Without freshness or validators we could never use the entry again
+        if not entry.is_fresh() and not entry.has_validators(): return None
+        with self.lock:
+            self.memory.put(key, entry)
+            if self.disk:
+                self.disk.put(key, entry)
+        self.stats.record("stores")
+        return entry
+
+    # A 304 confirms our copy; its headers replace the stored ones and the age restarts
+    def freshen(self, key, entry, headers):
+        merged = dict(entry.headers)
+        for name, value in headers.items():
+            if name in ("content-length", "transfer-encoding", "content-encoding", "connection"): continue
+            merged[name] = value
+        fresh = CacheEntry(key, entry.status, merged, entry.body)
+        with self.lock:
+            self.memory.put(key, fresh)
+            if self.disk:
+                self.disk.put(key, fresh)
+        return fresh
+
+    def invalidate(self, key):
+        with self.lock:
+            self.memory.remove(key)
+            if self.disk:
+                self.disk.remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.disk:
+                self.disk.clear()
+
+HTTP_CACHE = HTTPCache()
+
+"""
+Example: Tab.go_back() to https://example.org/ fetched 20 seconds ago with
+    Cache-Control: max-age=60
+    ETag: "abc"
+    -> lookup() finds the entry, current_age 20 < lifetime 60, body returned with no network  (hits += 1)
+
+Same page two minutes later:
+    -> entry is stale but has a validator, so the GET carries If-None-Match: "abc"
+    -> server answers 304 Not Modified, freshen() restarts the age, cached body returned  (revalidated += 1)
+"""
@@ -0,0 +1,123 @@
+import zlib
+
+ACCEPT_ENCODING = "gzip, deflate"   # sent with every request; identity is always acceptable too
+READ_SIZE = 64 * 1024               # bytes pulled from the socket at a time for Content-Length bodies
+
+# Raised when the server hangs up before a complete response was read
+class ConnectionClosed(ConnectionError):
+    pass
+
+# Body framed by Content-Length: yield it in READ_SIZE pieces
+def read_length(file, length):
+    remaining = length
+    while remaining > 0:
+        data = file.read(min(remaining, READ_SIZE))
+        if not data:
+            raise ConnectionClosed("connection closed in the middle of the body")
+        remaining -= len(data)
+        yield data
+
+# Body with no framing at all: it ends when the server closes the connection
+def read_until_close(file):
+    while True:
+        data = file.read(READ_SIZE)
+        if not data: return
+        yield data
+
+# Transfer-Encoding: chunked. Each chunk is "<hex size>[;extensions]\r\n<data>\r\n",
+# and a chunk of size 0 ends the body, optionally followed by trailer headers.
+def read_chunked(file):
+    while True:
+        line = file.readline()
+        if not line:
+            raise ConnectionClosed("connection closed in the middle of a chunked body")
+        size = int(line.split(b";", 1)[0].strip(), 16)
+        if size == 0:
+            while True:                 # skip trailers up to the blank line
+                line = file.readline()
+                if line in (b"\r\n", b"\n", b""): break
+            return
+        data = file.read(size)
+        if len(data) < size:
+            raise ConnectionClosed("connection closed in the middle of a chunk")
+        file.readline()                 # CRLF that ends the chunk data
+        yield data
+    """
+    Example body:
+        5\r\n
+        Hello\r\n
+        7;ext=1\r\n
+        , World\r\n
+        0\r\n
+        \r\n
+    yields b"Hello", b", World"
+    """
+
+class ContentDecoder:
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding in ("gzip", "x-gzip"):
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)    # 16+: expect a gzip header
+        elif encoding == "deflate":
+            self.decompressor = None    # decided on the first bytes, see below
+        else:
+            raise ValueError("unsupported content-encoding: " + encoding)
+
+    def decompress(self, data):
+        if self.decompressor is None:
+            # "deflate" is supposed to be zlib-wrapped, but plenty of servers send a raw deflate stream.
+            # A zlib stream starts with a header whose first two bytes are a multiple of 31.
+            zlib_wrapped = len(data) >= 2 and (data[0] & 0x0F) == 8 \
+                and ((data[0] << 8) | data[1]) % 31 == 0
+            self.decompressor = zlib.decompressobj(zlib.MAX_WBITS if zlib_wrapped else -zlib.MAX_WBITS)
+        return self.decompressor.decompress(data)
+
+    def flush(self):
+        if self.decompressor is None: return b""
+        return self.decompressor.flush()
+
+# Encodings are listed in the order they were applied, so they are removed in reverse
+def content_decoders(content_encoding):
+    encodings = [e.strip().casefold() for e in content_encoding.split(",")]
+    return [ContentDecoder(e) for e in reversed(encodings) if e and e != "identity"]
+
+def decode_chunk(decoders, chunk):
+    for decoder in decoders:
+        chunk = decoder.decompress(chunk)
+    return chunk
+
+# Drain what the decompressors still buffer, passing each tail through the later decoders
+def flush_decoders(decoders):
+    out = b""
+    for i, decoder in enumerate(decoders):
+        tail = decoder.flush()
+        out += decode_chunk(decoders[i + 1:], tail)
+    return out
+
+# Undo Content-Encoding as the body streams in
+def decode_content(chunks, content_encoding):
+    decoders = content_decoders(content_encoding)
+    if not decoders:
+        yield from chunks
+        return
+    for chunk in chunks:
+        chunk = decode_chunk(decoders, chunk)
+        if chunk: yield chunk
+    tail = flush_decoders(decoders)
+    if tail: yield tail
+
+# Framing that lets the connection be reused: the end of the body is known up front
+def has_framing(headers):
+    return "content-length" in headers \
+        or "chunked" in headers.get("transfer-encoding", "").casefold()
+
+# Pick the framing from the response headers and stream the decoded body
+def read_body(file, headers):
+    transfer_encoding = headers.get("transfer-encoding", "").casefold()
+    if "chunked" in transfer_encoding:
+        chunks = read_chunked(file)
+    elif "content-length" in headers:
+        chunks = read_length(file, int(headers["content-length"]))
+    else:
+        chunks = read_until_close(file)
+    return decode_content(chunks, headers.get("content-encoding", ""))
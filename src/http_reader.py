@@ -0,0 +1,183 @@
+import codecs
+from src.http_decoding import ConnectionClosed, READ_SIZE, read_body
+
+MAX_HEAD_BYTES = 64 * 1024      # status line + headers; anything bigger is not a response we want
+DEFAULT_CHARSET = "utf8"
+
+# "text/html; charset=ISO-8859-1" -> "iso-8859-1"
+def charset_of(headers):
+    for param in headers.get("content-type", "").split(";")[1:]:
+        if "=" not in param: continue
+        name, value = param.split("=", 1)
+        if name.strip().casefold() == "charset":
+            charset = value.strip().strip('"').casefold()
+            try:
+                return codecs.lookup(charset).name
+            except LookupError:
+                break
+    return DEFAULT_CHARSET
+
+# The single bytes -> str step for a whole body
+def decode_text(body, headers):
+    return str(body, charset_of(headers), "replace")
+
+# Size of the body as it will be handed to us, when it is known before reading it:
+# a Content-Length with no chunking and no compression in between
+def fixed_length(headers):
+    if "content-length" not in headers: return None
+    if "chunked" in headers.get("transfer-encoding", "").casefold(): return None
+    if headers.get("content-encoding", "identity").strip().casefold() != "identity": return None
+    return int(headers["content-length"])
+
+# Status line and header lines (without their line ends) -> version, status, reason, headers.
+# Shared by the blocking and asyncio readers, so both accept the same responses:
+# "HTTP/1.1 200" with no reason phrase is fine, a header line without a colon is skipped.
+def parse_head(lines):
+    version, status, explanation = (lines[0].split(" ", 2) + [""])[:3]
+    headers = {}
+    for line in lines[1:]:
+        if ":" not in line: continue
+        header, value = line.split(":", 1)
+        headers[header.casefold()] = value.strip()
+    return version, int(status), explanation, headers
+
+# Reads HTTP responses straight off a socket into one bytearray. Lives as long as the
+# connection, since bytes past the end of one response belong to the next one.
+class ResponseReader:
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()       # received but not yet consumed
+        self.pos = 0                    # start of the unconsumed part of buffer
+        self.bytes_read = 0
+
+    def buffered(self):
+        return len(self.buffer) - self.pos
+
+    def compact(self):
+        if self.pos:
+            del self.buffer[:self.pos]
+            self.pos = 0
+
+    def fill(self, size=READ_SIZE):
+        self.compact()
+        data = self.sock.recv(size)
+        self.bytes_read += len(data)
+        self.buffer += data
+        return len(data)
+
+    # Status line and headers, parsed from the buffer in one go once the blank line has arrived
+    def read_head(self):
+        while True:
+            end = self.buffer.find(b"\r\n\r\n", self.pos)
+            if end != -1: break
+            if self.buffered() > MAX_HEAD_BYTES:
+                raise ValueError("response headers too large")
+            if not self.fill():
+                if self.buffered() == 0:
+                    raise ConnectionClosed("connection closed before a response arrived")
+                raise ConnectionClosed("connection closed in the middle of the headers")
+        head = self.buffer[self.pos:end].decode("utf8", "replace")
+        self.pos = end + 4
+        return parse_head(head.split("\r\n"))
+
+    # File-like methods so http_decoding's chunked / read-to-close readers work unchanged
+    def readline(self):
+        while True:
+            end = self.buffer.find(b"\n", self.pos)
+            if end != -1:
+                line = bytes(self.buffer[self.pos:end + 1])
+                self.pos = end + 1
+                return line
+            if not self.fill():
+                line = bytes(self.buffer[self.pos:])
+                self.pos = len(self.buffer)
+                return line
+
+    # Like a buffered file: exactly size bytes unless the connection closes first
+    def read(self, size):
+        while self.buffered() < size:
+            if not self.fill(max(size - self.buffered(), READ_SIZE)): break
+        data = bytes(self.buffer[self.pos:self.pos + size])
+        self.pos += len(data)
+        return data
+
+    # Fill view completely: leftovers from the buffer first, then recv_into straight into it
+    def read_into(self, view):
+        n = min(self.buffered(), len(view))
+        view[:n] = self.buffer[self.pos:self.pos + n]
+        self.pos += n
+        while n < len(view):
+            got = self.sock.recv_into(view[n:])
+            if not got:
+                raise ConnectionClosed("connection closed in the middle of the body")
+            self.bytes_read += got
+            n += got
+
+    # The whole body. With a Content-Length it is exactly one allocation of the right size.
+    # on_piece, if given, sees every piece of the (content-decoded) body as soon as it is read.
+    def read_body(self, headers, on_piece=None):
+        length = fixed_length(headers)
+        if length is not None:
+            body = bytearray(length)
+            view = memoryview(body)
+            if on_piece is None:
+                self.read_into(view)
+                return body
+            for start in range(0, length, READ_SIZE):
+                piece = view[start:start + READ_SIZE]
+                self.read_into(piece)
+                on_piece(piece)
+            return body
+        pieces = []
+        for piece in read_body(self, headers):
+            pieces.append(piece)
+            if on_piece: on_piece(piece)
+        return b"".join(pieces)
+
+# Receives a document's body while it downloads and feeds it, decoded, to a fresh
+# consumer (an HTMLParser) made by make_consumer(url). The loader calls begin() when the
+# response that will be returned starts (again, if it had to retry), write() with each
+# piece of it, and end() once all of it is in. url is the one that response came from,
+# the redirect target if there was one, or None when the sink is not told.
+class TextSink:
+    def __init__(self, make_consumer):
+        self.make_consumer = make_consumer
+        self.consumer = None
+        self.decoder = None
+        self.url = None
+        self.complete = False
+
+    def begin(self, headers, url=None):
+        self.decoder = codecs.getincrementaldecoder(charset_of(headers))("replace")
+        self.url = url
+        self.consumer = self.make_consumer(url)
+        self.complete = False
+
+    def write(self, data):
+        text = self.decoder.decode(data)
+        if text: self.consumer.feed(text)
+
+    # Text the loader already decoded because it needs the str itself too (load_local)
+    def write_text(self, text):
+        if text: self.consumer.feed(text)
+
+    def end(self):
+        text = self.decoder.decode(b"", final=True)
+        if text: self.consumer.feed(text)
+        self.complete = True
+
+    # The consumer's result. When nothing was streamed (a cache hit, or a request that
+    # shared another one's transfer), body is fed in one piece instead.
+    def close(self, body):
+        if not self.complete:
+            self.consumer = self.make_consumer(self.url)
+            self.consumer.feed(body)
+        return self.consumer.close()
+
+"""
+Example: a 4 MB page with Content-Length: 4194304
+    before: makefile("r") decoded line by line, then read() built the str  (~2x the page in flight)
+    now:    bytearray(4194304) filled by recv_into, then one decode_text() (bytes + final str only)
+    with a TextSink: every 64 KB piece is decoded and parsed as soon as it is in, while the
+    kernel keeps receiving the next ones; the tree is done moments after the last byte
+"""
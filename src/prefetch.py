@@ -0,0 +1,188 @@
+import asyncio
+import threading
+import time
+from src.async_loader import warm_connection
+from src.connection_pool import POOL
+from src.html_parser import HTMLParser
+from src.scheduler import SCHEDULER, PREFETCH, RENDER_BLOCKING_CSS
+from src.transport import get_transport
+
+HOVER_DELAY = 0.065         # seconds the pointer has to rest on a link before we act on it
+SPECULATIVE_BUDGET = 10     # preconnects + prefetches allowed per page
+PREFETCH_TTL = 300          # seconds a prefetched document may be used for a navigation
+
+# Hover- and hint-driven warmup for one tab. Preconnect opens a pooled connection
+# to the link's origin; prefetch downloads the document itself.
+class Prefetcher:
+    def __init__(self, scheduler=SCHEDULER, log=None, loop=None):
+        self.scheduler = scheduler
+        self.log = log              # the tab's RequestLog, so speculative fetches show up in it too
+        self.loop = loop            # the asyncio loop the tab's navigations run on, if any
+        self.budget = SPECULATIVE_BUDGET
+        self.prefetched = {}        # str(url) -> (started_at, Future of (final URL, body))
+        self.hovered = None         # URL under the pointer
+        self.hover_owner = None     # scheduler owner for the hover's jobs, so leaving can cancel them
+        self.hover_preconnect = None    # the hover's preconnect Future, which on a loop the scheduler can't cancel
+        self.timer = None
+        self.lock = threading.Lock()
+
+    # A new page gets a new budget. Prefetched documents stay: one of them is
+    # probably the page being navigated to. Those nobody can use any more go.
+    def reset(self):
+        self.leave()
+        self.sweep()
+        self.budget = SPECULATIVE_BUDGET
+
+    # Drop prefetched entries that expired, failed or were cancelled
+    def sweep(self):
+        with self.lock:
+            for key, item in list(self.prefetched.items()):
+                if not self.usable(item):
+                    del self.prefetched[key]
+
+    def spend(self):
+        with self.lock:
+            if self.budget <= 0: return False
+            self.budget -= 1
+            return True
+
+    def hover(self, url):
+        if url is not None and self.hovered is not None and str(url) == str(self.hovered): return
+        self.leave()
+        if url is None: return
+        self.hovered = url
+        self.hover_owner = object()
+        # Wait a moment so sweeping the pointer across a page doesn't fire at every link
+        self.timer = threading.Timer(HOVER_DELAY, self.warm, (url, self.hover_owner))
+        self.timer.daemon = True
+        self.timer.start()
+
+    def warm(self, url, owner):
+        if owner is not self.hover_owner: return
+        self.hover_preconnect = self.preconnect(url, owner)
+        self.prefetch(url, owner=owner)
+
+    # Pointer left the link: forget the pending timer and drop queued work for it.
+    # A download that already started finishes and stays usable.
+    def leave(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        if self.hover_preconnect is not None:
+            self.hover_preconnect.cancel()      # on a loop: stops the connect, or its wait for a slot
+        if self.hover_owner is not None:
+            self.scheduler.cancel(self.hover_owner)
+            with self.lock:
+                for key, (started_at, future) in list(self.prefetched.items()):
+                    if future.cancelled():
+                        del self.prefetched[key]
+        self.hovered = None
+        self.hover_owner = None
+        self.hover_preconnect = None
+
+    def preconnect(self, url, owner=None):
+        if url.scheme not in ("http", "https"): return None
+        if not get_transport().network: return None     # replaying or loopback: there is no socket to warm
+        if not self.spend(): return None
+        if self.loop is not None:
+            # The navigation will go through that loop's AsyncConnectionPool, not POOL
+            return asyncio.run_coroutine_threadsafe(warm_connection(url), self.loop)
+        return self.scheduler.submit(
+            url, PREFETCH, owner=owner or self,
+            action=lambda: POOL.preconnect(url.scheme, url.host, url.port))
+
+    def prefetch(self, url, priority=PREFETCH, owner=None):
+        key = str(url)
+        self.sweep()
+        with self.lock:
+            if key in self.prefetched and self.usable(self.prefetched[key]): return self.prefetched[key][1]
+        if not self.spend(): return None
+        # The final URL comes along, so a navigation that takes this resolves links against it
+        future = self.scheduler.submit(url, priority, owner=owner or self,
+                                       action=lambda: url.request_with_url(log=self.log))
+        with self.lock:
+            self.prefetched[key] = (time.monotonic(), future)
+        return future
+
+    def usable(self, item):
+        started_at, future = item
+        if time.monotonic() - started_at > PREFETCH_TTL: return False
+        if future.cancelled(): return False
+        return not (future.done() and future.exception() is not None)
+
+    # <link rel=preconnect|prefetch|preload href=...> from the page just loaded
+    def hint(self, rel, url):
+        if rel == "preconnect":
+            self.preconnect(url)
+        elif rel == "prefetch":
+            self.prefetch(url)
+        elif rel == "preload":
+            self.prefetch(url, RENDER_BLOCKING_CSS)     # needed by this page, not a future one
+
+    # The prefetched (final URL, body) for a navigation to url, as a Future, or None
+    def take(self, url):
+        with self.lock:
+            item = self.prefetched.pop(str(url), None)
+        if item is None or not self.usable(item): return None
+        # The link under the pointer is the one being followed: its queued jobs now belong
+        # to the navigation, so the reset that comes with it must not cancel them
+        if self.hovered is not None and str(self.hovered) == str(url):
+            self.hover_owner = None
+            self.hover_preconnect = None
+        return item[1]
+
+    def cancel(self):
+        self.leave()
+        self.scheduler.cancel(self)
+
+# Runs inside the tokenizer while a document streams in (HTMLParser's preload hook):
+# every <link rel=stylesheet> starts downloading the moment its tag is parsed, so CSS
+# comes in alongside the rest of the page instead of after it. Resource hints go to
+# the tab's Prefetcher right away too. Other resources (<img>, <script src>) are
+# passed over: nothing in the browser loads them.
+class PreloadScanner:
+    def __init__(self, base, fetch_stylesheet, prefetcher=None):
+        self.base = base                            # URL the document's links are relative to
+        self.fetch_stylesheet = fetch_stylesheet    # url -> concurrent Future of the body
+        self.prefetcher = prefetcher
+        self.stylesheets = {}                       # str(url) -> Future, started early
+        self.lock = threading.Lock()                # found() runs on the thread doing the download
+
+    # make_consumer for the document's TextSink: base is the URL the response came from,
+    # which after a redirect is not the one the scanner was made with
+    def parser(self, base=None):
+        if base is not None: self.base = base
+        return HTMLParser(preload=self.found)
+
+    def found(self, node):
+        if node.tag != "link": return
+        rel = node.attributes.get("rel")
+        url = self.base.resolve(node.attributes.get("href"))
+        if url is None: return
+        if rel == "stylesheet":                     # the same test Tab.stylesheet_urls makes
+            with self.lock:
+                if str(url) in self.stylesheets: return
+                self.stylesheets[str(url)] = self.fetch_stylesheet(url)
+        elif self.prefetcher is not None and rel is not None \
+                and rel.casefold() in ("preconnect", "prefetch", "preload"):
+            self.prefetcher.hint(rel.casefold(), url)
+
+    # The Future of a stylesheet already on its way, or None
+    def take(self, url):
+        with self.lock:
+            return self.stylesheets.pop(str(url), None)
+
+"""
+Example: the pointer rests on <a href="/next"> for 65ms
+    warm(/next)  -> preconnect: scheduler runs POOL.preconnect, a socket for the origin sits idle
+                                (the asyncio loop's pool instead, for a tab on a TkAsyncBridge)
+                 -> prefetch:   scheduler runs URL("/next").request_with_url(), the Future goes in prefetched
+    click        -> Tab.load takes the Future instead of queueing a new request,
+                    so the page is already downloaded (or on its way)
+Pointer moves off before the 65ms are up -> leave() cancels the timer, nothing is fetched.
+
+Example: a 2 MB page with <link rel=stylesheet href=/main.css> in its <head>
+    before: main.css was requested after the last byte of the page was in and parsed
+    now:    the first 64 KB piece is fed to the parser, found() sees the <link> and
+            queues main.css, which downloads while the rest of the page still does
+"""
@@ -0,0 +1,117 @@
+import collections
+import json
+import threading
+import time
+
+MAX_LOGGED_REQUESTS = 1000      # per tab; the oldest entries fall off
+PHASES = ["dns", "connect", "tls", "send", "ttfb", "download"]
+
+# Where the time of one request went, in seconds. Phases that didn't happen stay 0:
+# a reused connection has no dns / connect / tls, a cache hit has no network at all.
+class RequestTiming:
+    def __init__(self, url, method):
+        self.url = str(url)
+        self.method = method
+        self.started_at = time.time()       # wall clock, for the export
+        self.start = time.perf_counter()
+        self.dns = 0.0              # resolver lookup (0 when RESOLVER had it cached)
+        self.connect = 0.0          # TCP connect, all happy eyeballs attempts included
+        self.tls = 0.0              # TLS handshake
+        self.send = 0.0             # writing the request
+        self.ttfb = 0.0             # request sent -> status line and headers in
+        self.download = 0.0         # headers in -> body fully read and content-decoded
+        self.total = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0     # on the wire: headers plus the still-compressed body
+        self.status = None
+        self.reused = False         # went out on a pooled keep-alive connection
+        self.source = "network"     # "network", "cache", "revalidated", "local", "shared", or "replay" / "loopback" (see transport)
+        self.error = None
+
+    # Setup costs of a new connection belong to the first request that uses it
+    def connection(self, conn):
+        self.reused = conn.reused
+        if not conn.reused:
+            self.dns, self.connect, self.tls = conn.dns_time, conn.connect_time, conn.tls_time
+
+    def finish(self, status=None, error=None):
+        self.total = time.perf_counter() - self.start
+        self.status = status
+        if error is not None:
+            self.error = "{}: {}".format(type(error).__name__, error)
+
+    # The caller waited for an identical request already in flight (single_flight) instead
+    # of making its own: its total is the wait, the phases and bytes are in that request's entry
+    def shared(self, log, error=None):
+        self.source = "shared"
+        self.finish(error=error)
+        if log is not None: log.add(self)
+
+    def network_time(self):
+        return sum(getattr(self, phase) for phase in PHASES)
+
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "method": self.method,
+            "status": self.status,
+            "started_at": self.started_at,
+            "source": self.source,
+            "reused": self.reused,
+            **{phase: getattr(self, phase) for phase in PHASES},
+            "total": self.total,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "error": self.error,
+        }
+
+# Every request made for one tab, oldest first. Filled from scheduler threads
+# and the asyncio loop, read from the UI thread.
+class RequestLog:
+    def __init__(self, max_entries=MAX_LOGGED_REQUESTS):
+        self.timings = collections.deque(maxlen=max_entries)
+        self.lock = threading.Lock()
+
+    def add(self, timing):
+        with self.lock:
+            self.timings.append(timing)
+
+    def entries(self, url=None):
+        with self.lock:
+            timings = list(self.timings)
+        if url is None: return timings
+        return [t for t in timings if t.url == str(url)]
+
+    def clear(self):
+        with self.lock:
+            self.timings.clear()
+
+    # Seconds per phase and bytes, added up over every logged request
+    def summary(self):
+        timings = self.entries()
+        totals = {phase: sum(getattr(t, phase) for t in timings) for phase in PHASES}
+        totals["requests"] = len(timings)
+        totals["total"] = sum(t.total for t in timings)
+        totals["bytes_sent"] = sum(t.bytes_sent for t in timings)
+        totals["bytes_received"] = sum(t.bytes_received for t in timings)
+        return totals
+
+    def to_json(self, indent=None):
+        return json.dumps({
+            "requests": [t.to_dict() for t in self.entries()],
+            "summary": self.summary(),
+        }, indent=indent)
+
+    def export(self, path):
+        with open(path, "w", encoding="utf8") as f:
+            f.write(self.to_json(indent=2))
+
+"""
+Example: loading https://example.org/ in a fresh tab, then tab.request_log.to_json()
+    {"url": "https://example.org/", "source": "network", "reused": false,
+     "dns": 0.021, "connect": 0.034, "tls": 0.071, "send": 0.0001, "ttfb": 0.118,
+     "download": 0.009, "total": 0.254, "bytes_sent": 112, "bytes_received": 1789, ...}
+    {"url": "https://example.org/style.css", "reused": true, "dns": 0, "connect": 0, "tls": 0, ...}
+ttfb dominating the sum means the page waits on the server; a small sum next to a
+slow Tab.load means the time goes into parsing, styling and layout.
+"""
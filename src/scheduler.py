@@ -0,0 +1,139 @@
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+
+# Priority classes, most urgent first
+DOCUMENT = 0                # the page being navigated to
+RENDER_BLOCKING_CSS = 1     # stylesheets the first render waits on
+PREFETCH = 2                # speculative fetches nobody is waiting for yet
+
+MAX_REQUESTS_PER_HOST = 6   # what browsers traditionally allow per origin over HTTP/1.1
+MAX_REQUESTS_TOTAL = 16     # also the number of worker threads
+
+class Job:
+    def __init__(self, priority, seq, url, payload, owner, action, log=None, sink=None):
+        self.priority = priority
+        self.seq = seq              # submission order breaks ties, so equal priorities stay FIFO
+        self.url = url
+        self.payload = payload
+        self.owner = owner          # usually a Tab, used for cancellation
+        self.action = action        # what to run instead of url.request(payload), e.g. a preconnect
+        self.log = log              # RequestLog the request's timings go to
+        self.sink = sink            # TextSink the body is streamed into, e.g. the tab's parser
+        self.future = Future()
+
+    def run(self):
+        if self.action is not None:
+            return self.action()
+        return self.url.request(self.payload, log=self.log, sink=self.sink)
+
+    def host_key(self):
+        return (self.url.scheme, self.url.host, self.url.port)
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class RequestScheduler:
+    def __init__(self, max_per_host=MAX_REQUESTS_PER_HOST, max_total=MAX_REQUESTS_TOTAL):
+        self.max_per_host = max_per_host
+        self.max_total = max_total
+        self.queue = []             # heap of waiting Jobs
+        self.active = {}            # host key -> number of requests running against that host
+        self.running = 0
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.workers = []
+        self.closed = False
+
+    # Queue url.request(payload) and return a Future for its body. With action, run that
+    # instead; it still counts against url's host, so speculative work obeys the same caps.
+    def submit(self, url, priority=DOCUMENT, payload=None, owner=None, action=None, log=None, sink=None):
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("scheduler is shut down")
+            job = Job(priority, next(self.seq), url, payload, owner, action, log, sink)
+            heapq.heappush(self.queue, job)
+            if len(self.workers) < self.max_total:
+                self.start_worker()
+            self.cond.notify()
+        return job.future
+
+    # Drop every queued request belonging to owner, e.g. when a tab navigates away.
+    # Requests already on the wire finish (their bytes still land in the cache and pool),
+    # but their futures are not waited on by anyone.
+    def cancel(self, owner):
+        with self.cond:
+            kept = []
+            for job in self.queue:
+                if job.owner is owner:
+                    job.future.cancel()
+                else:
+                    kept.append(job)
+            heapq.heapify(kept)
+            self.queue = kept
+
+    def start_worker(self):
+        worker = threading.Thread(target=self.work, daemon=True)
+        self.workers.append(worker)
+        worker.start()
+
+    # The most urgent job whose host still has a free slot. Caller holds the lock.
+    def next_job(self):
+        if self.running >= self.max_total: return None
+        skipped = []
+        job = None
+        while self.queue:
+            candidate = heapq.heappop(self.queue)
+            if self.active.get(candidate.host_key(), 0) < self.max_per_host:
+                job = candidate
+                break
+            skipped.append(candidate)
+        for candidate in skipped:
+            heapq.heappush(self.queue, candidate)
+        return job
+
+    def work(self):
+        while True:
+            with self.cond:
+                job = self.next_job()
+                while job is None:
+                    if self.closed: return
+                    self.cond.wait()
+                    job = self.next_job()
+                if not job.future.set_running_or_notify_cancel():
+                    continue            # cancelled while queued
+                key = job.host_key()
+                self.active[key] = self.active.get(key, 0) + 1
+                self.running += 1
+
+            try:
+                job.future.set_result(job.run())
+            except BaseException as e:
+                job.future.set_exception(e)
+            finally:
+                with self.cond:
+                    self.active[key] -= 1
+                    if not self.active[key]:
+                        del self.active[key]
+                    self.running -= 1
+                    self.cond.notify_all()      # a host slot opened up
+
+    def shutdown(self):
+        with self.cond:
+            self.closed = True
+            for job in self.queue:
+                job.future.cancel()
+            self.queue = []
+            self.cond.notify_all()
+
+SCHEDULER = RequestScheduler()
+
+"""
+Example: Tab.load on a page with 8 stylesheets from the same host, while another tab prefetches
+    submit(page, DOCUMENT)                   -> runs right away
+    submit(css1..css8, RENDER_BLOCKING_CSS)  -> 6 run in parallel, 2 wait for a host slot
+    submit(other, PREFETCH)                  -> lowest priority, but its host has free slots, so it
+                                                runs ahead of the 2 stylesheets stuck on the host cap
+Navigating the tab away calls cancel(tab): the 2 waiting stylesheets are dropped.
+"""
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+# Same resource, same request: scheme and host are case-insensitive and the
+# fragment never reaches the server
+def flight_key(method, url):
+    path = url.path.split("#", 1)[0]
+    return (method, url.scheme.casefold(), url.host.casefold(), url.port, path)
+
+class FlightStats:
+    def __init__(self):
+        self.started = 0            # fetches that actually went out
+        self.collapsed = 0          # callers that waited on someone else's fetch instead
+        self.lock = threading.Lock()
+
+    def record(self, collapsed):
+        with self.lock:
+            if collapsed:
+                self.collapsed += 1
+            else:
+                self.started += 1
+
+    def snapshot(self):
+        total = self.started + self.collapsed
+        return {
+            "started": self.started,
+            "collapsed": self.collapsed,
+            "collapse_rate": self.collapsed / total if total else 0.0,
+        }
+
+# The first caller for a key runs fn; callers arriving while it runs wait and get its result.
+# The call in progress is a concurrent Future, so AsyncSingleFlight can share the same keys.
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}             # key -> Future of the call in progress
+        self.stats = FlightStats()
+        self.lock = threading.Lock()
+
+    # The Future for key's call, and whether the caller is the one who has to make it
+    def join(self, key):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+        self.stats.record(not leader)
+        return future, leader
+
+    def finish(self, key, future, result=None, error=None):
+        with self.lock:
+            del self.calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    # waited, if given, is called with the call's error (or None) when the caller
+    # didn't run fn itself but got another caller's result
+    def do(self, key, fn, waited=None):
+        future, leader = self.join(key)
+        if not leader:
+            error = None
+            try:
+                return future.result()
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                if waited is not None: waited(error)
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result
+
+# asyncio flavour over the same calls: waiters await the call's Future instead of
+# blocking a thread, and a blocking URL.request for a URL an asyncio fetch is already
+# getting (or the other way round) waits for that one instead of fetching it again
+class AsyncSingleFlight:
+    def __init__(self, flight):
+        self.flight = flight
+
+    async def do(self, key, make_coro, waited=None):
+        future, leader = self.flight.join(key)
+        if leader:
+            task = asyncio.ensure_future(make_coro())
+            task.add_done_callback(lambda task: self.finished(key, future, task))
+            waited = None
+        error = None
+        try:
+            # shield: one waiter being cancelled (its tab navigated away) must not cancel the others
+            return await asyncio.shield(asyncio.wrap_future(future))
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if waited is not None: waited(error)
+
+    def finished(self, key, future, task):
+        error = asyncio.CancelledError() if task.cancelled() else task.exception()
+        self.flight.finish(key, future, None if error else task.result(), error)
+
+IN_FLIGHT = SingleFlight()
+ASYNC_IN_FLIGHT = AsyncSingleFlight(IN_FLIGHT)
+
+"""
+Example: two tabs of the same site load at once, both linking /style.css
+    tab 1 worker -> IN_FLIGHT.do(("GET", "https", "example.org", 443, "/style.css"), fetch)  leader, fetches
+    tab 2 worker -> same key while tab 1's fetch is running                              waits
+    both get the same body; stats: started 1, collapsed 1
+    tab 2's RequestLog gets a "shared" entry whose total is its wait, tab 1's has the transfer
+    a third tab on a TkAsyncBridge fetching /style.css meanwhile awaits the same Future  collapsed 2
+"""
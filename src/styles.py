@@ -1,13 +1,14 @@
 import os
-from src.layout import Element
+from src.html_parser import Element, Text
 from src.constants import INHERITED_PROPERTIES
 
 class TagSelector:
     def __init__(self, tag):
         self.tag = tag
         self.priority = 1
+        self.key = tag          # RuleIndex bucket: the tag an element needs for this to match
 
-    def matches(self, node):    # test whether selector matches an element
+    def matches(self, node, ancestors=None):    # test whether selector matches an element
         return isinstance(node, Element) and self.tag == node.tag
     
     def __repr__(self):
@@ -18,15 +19,29 @@ class DescendantSelector:
         self.ancestor = ancestor
         self.descendant = descendant
         self.priority = ancestor.priority + descendant.priority
+        self.key = descendant.key       # only the rightmost part says which elements to try
+        # "div p span" as [TagSelector("div"), TagSelector("p"), TagSelector("span")]
+        left = ancestor.chain if isinstance(ancestor, DescendantSelector) else [ancestor]
+        self.chain = left + [descendant]
+        self.ancestor_keys = tuple({part.key for part in self.chain[:-1]})   # what must be somewhere above
 
-    # check if node matches the descendant part of selector, 
-    # and if any of its ancestors match ancestor selector
-    def matches(self, node): 
+    # check if node matches the last part of the chain, then walk up the dom tree once,
+    # matching the other parts right to left on the way. Taking the nearest ancestor that
+    # matches each part is always safe: anything further up has fewer ancestors left.
+    # With the AncestorFilter of the style() traversal, a chain that needs a tag no
+    # ancestor has is turned down before any walking.
+    def matches(self, node, ancestors=None):
         if not self.descendant.matches(node): return False      # if node isnt the kind of element the descendant targets, return false
-        while node.parent:                                      # walk up the dom tree
-            if self.ancestor.matches(node.parent): return True  # if any parent matches the ancestor selector, return True
+        if ancestors is not None and not ancestors.has_all(self.ancestor_keys): return False
+        chain = self.chain
+        i = len(chain) - 2                                      # the part to find next
+        node = node.parent
+        while node is not None:                                 # walk up the dom tree
+            if chain[i].matches(node):
+                if i == 0: return True                          # every part found, in order
+                i -= 1
             node = node.parent                                  # go one level up and repeat
-        return False                                            # if no ancestor matches after traversing up, return false
+        return False                                            # ran out of ancestors first
     
     def __repr__(self):
         return f"DescendantSelector({self.ancestor}, {self.descendant})"
@@ -168,15 +183,91 @@ script_dir = os.path.dirname(os.path.abspath(__file__))
 css_path = os.path.join(script_dir, "browser.css")
 DEFAULT_STYLE_SHEET = CSSParser(open(css_path).read()).parse()
 
-def style(node, rules):
+# The rules (already in cascade order) bucketed by their selector's key, so an element
+# is only tested against rules whose rightmost selector can match it: a <p> looks at
+# "p", "div p", "article div p" ... and never at the thousands of others. Appending in
+# order keeps every bucket in cascade order. Keys are tags for now; class and id
+# selectors would get buckets of their own the same way.
+class RuleIndex:
+    def __init__(self, rules):
+        self.rules = rules
+        self.buckets = {}       # key -> [(selector, body), ...]
+        for rule in rules:
+            self.buckets.setdefault(rule[0].key, []).append(rule)
+
+    def candidates(self, node):
+        return self.buckets.get(node.tag, ())
+
+# The tags, ids (#main) and classes (.note) of the elements above the one being styled,
+# kept up to date as style() goes down and comes back up the tree. A selector needing
+# an ancestor key that isn't here can't match, whatever the depth: one dict lookup per key.
+# (An exact count per key rather than a Bloom filter's bits: in Python a dict lookup is
+# as cheap as hashing into a bit array would be, and there are no false positives.)
+class AncestorFilter:
+    def __init__(self, node=None):
+        self.counts = {}        # key -> how many elements on the current path have it
+        while node is not None:
+            self.push(node)     # styling a subtree: its ancestors count too
+            node = node.parent
+
+    @staticmethod
+    def keys(node):
+        keys = [node.tag]
+        attributes = node.attributes
+        if attributes:
+            if "id" in attributes:
+                keys.append("#" + attributes["id"])
+            for name in attributes.get("class", "").split():
+                keys.append("." + name)
+        return keys
+
+    # Returns the keys to hand back to pop once node's subtree is done
+    def push(self, node):
+        keys = self.keys(node)
+        counts = self.counts
+        for key in keys:
+            counts[key] = counts.get(key, 0) + 1
+        return keys
+
+    def pop(self, keys):
+        counts = self.counts
+        for key in keys:
+            count = counts[key] - 1
+            if count:
+                counts[key] = count
+            else:
+                del counts[key]
+
+    def has_all(self, keys):
+        counts = self.counts
+        for key in keys:
+            if key not in counts: return False
+        return True
+
+# The part of node's computed style its children inherit
+def inherited_style(node):
+    return {property: node.style[property] for property in INHERITED_PROPERTIES}
+
+# rules: a RuleIndex, or the sorted list of (selector, body) to build one from
+def style(node, rules, ancestors=None):
+    if not isinstance(rules, RuleIndex):
+        rules = RuleIndex(rules)
+    # Text only ever inherits (no selector or style attribute applies to it), so the
+    # text children of an element share one dict of its inherited properties
+    # (not its whole style: a background-color is the element's, not its text's)
+    if isinstance(node, Text):
+        node.style = inherited_style(node.parent)
+        return
+    if ancestors is None:
+        ancestors = AncestorFilter(node.parent)
     node.style= {}
     for property, default_value in INHERITED_PROPERTIES.items():
         if node.parent:
             node.style[property] = node.parent.style[property]
         else:
             node.style[property] = default_value
-    for selector, body in rules:
-        if not selector.matches(node): continue
+    for selector, body in rules.candidates(node):
+        if not selector.matches(node, ancestors): continue
         for property, value in body.items():
             node.style[property] = value
 
@@ -199,8 +290,15 @@ def style(node, rules):
         parent_px = float(parent_font_size[:-2])                        # if parent_px 16px, strip px -> 16 -> 16.0
         node.style["font-size"] = str(node_pct * parent_px) + "px"      # 1.2 * 16 = 19.2, final font size = 19.2px
         
+    keys = ancestors.push(node)
+    text_style = None
     for child in node.children:
-        style(child, rules)
+        if isinstance(child, Text):
+            if text_style is None: text_style = inherited_style(node)
+            child.style = text_style
+        else:
+            style(child, rules, ancestors)
+    ancestors.pop(keys)
     """
     Example: <div style="color: red"> <span style = "font-size: 20px">Text</span> </div>
     after style(root_node):
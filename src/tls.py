@@ -0,0 +1,126 @@
+import ssl
+import threading
+import time
+
+MAX_SESSIONS = 256          # hosts whose TLS session we remember
+
+_context = None
+_context_lock = threading.Lock()
+
+# One context for the whole process. create_default_context() loads the system CA store,
+# which is far too slow to repeat for every connection.
+def get_ssl_context():
+    global _context
+    if _context is None:
+        with _context_lock:
+            if _context is None:
+                _context = ssl.create_default_context()
+    return _context
+
+class TLSStats:
+    def __init__(self):
+        self.full_handshakes = 0
+        self.resumed_handshakes = 0
+        self.handshake_time = 0.0       # seconds spent in handshakes, full and resumed
+        self.lock = threading.Lock()
+
+    def record(self, elapsed, resumed):
+        with self.lock:
+            self.handshake_time += elapsed
+            if resumed:
+                self.resumed_handshakes += 1
+            else:
+                self.full_handshakes += 1
+
+    def handshakes(self):
+        return self.full_handshakes + self.resumed_handshakes
+
+    def hit_rate(self):
+        total = self.handshakes()
+        return self.resumed_handshakes / total if total else 0.0
+
+    def average_handshake_time(self):
+        total = self.handshakes()
+        return self.handshake_time / total if total else 0.0
+
+    def snapshot(self):
+        return {
+            "full_handshakes": self.full_handshakes,
+            "resumed_handshakes": self.resumed_handshakes,
+            "handshake_time": self.handshake_time,
+            "average_handshake_time": self.average_handshake_time(),
+            "resumption_hit_rate": self.hit_rate(),
+        }
+
+    def reset(self):
+        with self.lock:
+            self.full_handshakes = 0
+            self.resumed_handshakes = 0
+            self.handshake_time = 0.0
+
+class SessionCache:
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self.sessions = {}              # (host, port) -> ssl.SSLSession, oldest first
+        self.lock = threading.Lock()
+
+    def get(self, host, port):
+        with self.lock:
+            return self.sessions.get((host, port))
+
+    # TLS 1.3 servers send their session ticket after the handshake, so the session
+    # is only worth saving once some application data has been read on the socket.
+    def save(self, sock, host, port):
+        session = getattr(sock, "session", None)
+        if session is None: return
+        with self.lock:
+            self.sessions.pop((host, port), None)
+            self.sessions[(host, port)] = session
+            while len(self.sessions) > self.max_sessions:
+                del self.sessions[next(iter(self.sessions))]
+
+    def forget(self, host, port):
+        with self.lock:
+            self.sessions.pop((host, port), None)
+
+    def clear(self):
+        with self.lock:
+            self.sessions = {}
+
+TLS_STATS = TLSStats()
+SESSIONS = SessionCache()
+
+# Wrap a connected TCP socket, offering the cached session for this host when we have one
+def wrap_socket(sock, host, port):
+    ctx = get_ssl_context()
+    session = SESSIONS.get(host, port)
+    start = time.perf_counter()
+    try:
+        s = ctx.wrap_socket(sock, server_hostname=host, session=session)
+    except ssl.SSLError:
+        # Don't offer a session that may have caused this to the next connection
+        SESSIONS.forget(host, port)
+        raise
+    TLS_STATS.record(time.perf_counter() - start, s.session_reused)
+    return s
+
+# What asyncio.open_connection gets as its ssl argument. All asyncio does with it is call
+# wrap_bio, which has no way to be told about a session, so this passes the shared
+# context's wrap_bio the cached session for host and port.
+class SessionOffer:
+    def __init__(self, host, port):
+        self.context = get_ssl_context()
+        self.host = host
+        self.port = port
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        return self.context.wrap_bio(incoming, outgoing, server_side, server_hostname,
+                                     session=session or SESSIONS.get(self.host, self.port))
+
+"""
+Example: three stylesheets from https://example.org, each on its own connection
+    1st connection  -> no cached session, full handshake    (full_handshakes = 1)
+                    -> response read, SESSIONS.save()       (ticket stored for example.org:443)
+    2nd connection  -> session offered and accepted         (resumed_handshakes = 1)
+    3rd connection  -> resumed again                        (hit_rate = 2/3)
+"""
@@ -0,0 +1,185 @@
+import asyncio
+import base64
+import json
+import threading
+import time
+from src.server import do_request
+
+# What moves one request to the server and the response back, underneath the cache,
+# redirect and single-flight layers of URL.request. Every transport has a
+# fetch(url, method, payload, headers, timing, sink=None) that returns (status, headers,
+# body bytes) with the body already content-decoded, and fills in the request's
+# RequestTiming. A sink may be streamed to; if it isn't, the caller falls back to the
+# returned body.
+class Transport:
+    network = False             # True only for the real sockets-and-pool path
+    cached = True               # whether HTTP_CACHE answers and revalidates in front of it
+
+    # asyncio flavour; by default the blocking fetch runs on a worker thread
+    async def fetch_async(self, url, method, payload, headers, timing, sink=None):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.fetch, url, method, payload, headers, timing, sink)
+
+# Pooled keep-alive sockets, i.e. what URL.request always did
+class NetworkTransport(Transport):
+    network = True
+
+    def fetch(self, url, method, payload, headers, timing, sink=None):
+        return url.fetch(method, payload, headers, timing, sink)
+
+class NotRecorded(ConnectionError):
+    pass
+
+# Headers that describe the wire form of the body. Recorded bodies are stored
+# already decoded, so these no longer apply to them.
+WIRE_HEADERS = ["content-encoding", "transfer-encoding", "content-length", "connection", "keep-alive"]
+
+def archive_key(method, url, payload):
+    return (method, str(url), payload or None)
+
+# One JSON object per line: the request line, request headers and payload, and the
+# response status, headers and base64 body. The request side is taken from the bytes
+# URL.request_bytes puts on the wire, so Host, Accept-Encoding and the rest are in it.
+def exchange_record(url, method, payload, headers, status, response_headers, content):
+    response_headers = {k: v for k, v in response_headers.items() if k not in WIRE_HEADERS}
+    response_headers["content-length"] = str(len(content))
+    head = url.request_bytes(method, payload, headers).split(b"\r\n\r\n", 1)[0]
+    request_line, *header_lines = head.decode("utf8").split("\r\n")
+    return {
+        "request_line": request_line,
+        "method": method,
+        "url": str(url),
+        "request_headers": dict(line.split(": ", 1) for line in header_lines),
+        "payload": payload,
+        "status": status,
+        "headers": response_headers,
+        "body": base64.b64encode(content).decode("ascii"),
+    }
+
+# Does real requests through inner and appends every exchange to the archive file.
+# The HTTP cache stays out of the way, so every request of a load reaches the network
+# and is recorded with its full body: no fresh hits left out, no bodiless 304s.
+class RecordingTransport(Transport):
+    cached = False
+
+    def __init__(self, path, inner=None):
+        self.path = path
+        self.inner = inner or NetworkTransport()
+        self.lock = threading.Lock()
+
+    def fetch(self, url, method, payload, headers, timing, sink=None):
+        status, response_headers, content = self.inner.fetch(url, method, payload, headers, timing, sink)
+        record = exchange_record(url, method, payload, headers, status, response_headers, content)
+        with self.lock:
+            with open(self.path, "a", encoding="utf8") as f:
+                f.write(json.dumps(record) + "\n")
+        return status, response_headers, content
+
+def load_archive(path):
+    responses = {}              # archive_key -> [(status, headers, body), ...] in recorded order
+    with open(path, encoding="utf8") as f:
+        for line in f:
+            if not line.strip(): continue
+            record = json.loads(line)
+            key = archive_key(record["method"], record["url"], record["payload"])
+            body = base64.b64decode(record["body"])
+            responses.setdefault(key, []).append((record["status"], record["headers"], body))
+    return responses
+
+# Answers from a recorded archive, entirely from memory. latency (seconds per request)
+# and bandwidth (bytes per second, None for unlimited) stand in for the network,
+# so timings look like a real connection but are the same on every run. Like recording,
+# it bypasses the HTTP cache: the archive is the cache, whatever state HTTP_CACHE is in.
+class ReplayTransport(Transport):
+    cached = False
+
+    def __init__(self, path, latency=0.0, bandwidth=None):
+        self.responses = load_archive(path)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.served = {}            # archive_key -> how many of its responses were handed out
+        self.lock = threading.Lock()
+
+    # Repeated requests get the recorded responses in order, then the last one again
+    def lookup(self, url, method, payload):
+        key = archive_key(method, url, payload)
+        if key not in self.responses:
+            raise NotRecorded("{} {} is not in the archive".format(method, url))
+        with self.lock:
+            n = self.served.get(key, 0)
+            self.served[key] = n + 1
+        recorded = self.responses[key]
+        status, headers, body = recorded[min(n, len(recorded) - 1)]
+        return status, dict(headers), body
+
+    def transfer_time(self, body):
+        return len(body) / self.bandwidth if self.bandwidth else 0.0
+
+    def fetch(self, url, method, payload, headers, timing, sink=None):
+        status, response_headers, body = self.lookup(url, method, payload)
+        time.sleep(self.latency + self.transfer_time(body))
+        simulate_timing(timing, "replay", self.latency, self.transfer_time(body), body)
+        return status, response_headers, body
+
+    async def fetch_async(self, url, method, payload, headers, timing, sink=None):
+        status, response_headers, body = self.lookup(url, method, payload)
+        await asyncio.sleep(self.latency + self.transfer_time(body))
+        simulate_timing(timing, "replay", self.latency, self.transfer_time(body), body)
+        return status, response_headers, body
+
+def simulate_timing(timing, source, ttfb, download, body):
+    timing.source = source
+    timing.ttfb = ttfb
+    timing.download = download
+    timing.bytes_received = len(body)
+
+# Calls a server's request handler in-process: src/server.py's do_request by default.
+# No sockets, no archive, and the guest book still works.
+class LoopbackTransport(Transport):
+    def __init__(self, handler=do_request, latency=0.0):
+        self.handler = handler
+        self.latency = latency
+
+    def respond(self, url, method, payload, headers, timing):
+        start = time.perf_counter()
+        request_headers = {"host": url.host, **{k.casefold(): v for k, v in headers.items()}}
+        status, body = self.handler(method, url.path, request_headers, payload)
+        body = body.encode("utf8")
+        simulate_timing(timing, "loopback", self.latency + time.perf_counter() - start, 0.0, body)
+        response_headers = {
+            "content-type": "text/html; charset=utf-8",
+            "content-length": str(len(body)),
+        }
+        return int(status.split(" ", 1)[0]), response_headers, body
+
+    def fetch(self, url, method, payload, headers, timing, sink=None):
+        time.sleep(self.latency)
+        return self.respond(url, method, payload, headers, timing)
+
+    async def fetch_async(self, url, method, payload, headers, timing, sink=None):
+        await asyncio.sleep(self.latency)
+        return self.respond(url, method, payload, headers, timing)
+
+_transport = NetworkTransport()
+
+def get_transport():
+    return _transport
+
+# Swap the transport every URL.request and async fetch goes through; returns the old one
+def set_transport(transport):
+    global _transport
+    previous = _transport
+    _transport = transport or NetworkTransport()
+    return previous
+
+"""
+Example: benchmark a page load offline
+    set_transport(RecordingTransport("pages.jsonl"))        # once, with network
+    tab.load(URL("https://browser.engineering/"))           # every exchange lands in pages.jsonl
+
+    set_transport(ReplayTransport("pages.jsonl", latency=0.05, bandwidth=1_000_000))
+    tab.load(URL("https://browser.engineering/"))           # same bytes, 50ms + 1 MB/s, no sockets
+
+    set_transport(LoopbackTransport())                      # the guest book from src/server.py
+    URL("http://localhost:8000/").request()
+"""
@@ -1,24 +1,133 @@
-import socket
-import ssl
+import functools
+import re
+import sys
+import threading
+import time
+from src.connection_pool import POOL
+from src.http_decoding import ACCEPT_ENCODING, has_framing
+from src.http_reader import decode_text
+from src.local_files import load_local
+from src.http_cache import HTTP_CACHE
+from src.single_flight import IN_FLIGHT, flight_key
+from src.request_timing import RequestTiming
+from src.transport import get_transport
 
+# The socket can only be reused if we know where this response ends.
+# HTTP/1.1 keeps connections open by default, HTTP/1.0 only when asked to.
+def keeps_alive(version, response_headers):
+    connection = response_headers.get("connection", "").casefold()
+    if version == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+def has_body(method, status):
+    return not (method == "HEAD" or status < 200 or status in (204, 304))
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "TRACE", "PUT", "DELETE")
+
+# A reused socket that fails before a single byte of the response came back was most
+# likely closed by the server while idle, so the request never got to it. Anything
+# else (part of a response read, or a POST the server may already have acted on)
+# must not be sent a second time.
+def may_retry(conn, method, received):
+    return conn.reused and not received and method in IDEMPOTENT_METHODS
+
+NETWORK_SCHEMES = ("http", "https")
+LOCAL_SCHEMES = ("file", "data")
+SCHEMES = NETWORK_SCHEMES + LOCAL_SCHEMES
+
+REDIRECT_STATUSES = [301, 302, 303, 307, 308]
+PERMANENT_REDIRECT_STATUSES = [301, 308]
+MAX_REDIRECTS = 10
+MAX_REMEMBERED_REDIRECTS = 1024
+
+class TooManyRedirects(Exception):
+    pass
+
+def is_redirect(status, response_headers):
+    return status in REDIRECT_STATUSES and bool(response_headers.get("location"))
+
+# Where a redirect response points, resolved against the URL that returned it
+def redirect_target(url, status, response_headers):
+    if not is_redirect(status, response_headers): return None
+    target = url.resolve(response_headers["location"])
+    # A server doesn't get to send us to file: or data: (same rule as every browser)
+    if target is None or target.scheme not in NETWORK_SCHEMES: return None
+    return target
+
+# 301 and 308 answers, so later navigations go straight to where they point
+class RedirectCache:
+    def __init__(self, max_entries=MAX_REMEMBERED_REDIRECTS):
+        self.max_entries = max_entries
+        self.targets = {}           # str(url) -> target URL, oldest first
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def remember(self, url, target):
+        with self.lock:
+            self.targets.pop(str(url), None)
+            self.targets[str(url)] = target
+            while len(self.targets) > self.max_entries:
+                del self.targets[next(iter(self.targets))]
+
+    # Follow remembered hops from url; stops at the first URL we have no entry for
+    def lookup(self, url):
+        seen = set()
+        with self.lock:
+            while str(url) in self.targets and str(url) not in seen:
+                seen.add(str(url))
+                url = self.targets[str(url)]
+        if seen:
+            self.hits += 1
+        return url
+
+    def forget(self, url):
+        with self.lock:
+            self.targets.pop(str(url), None)
+
+    def clear(self):
+        with self.lock:
+            self.targets = {}
+
+PERMANENT_REDIRECTS = RedirectCache()
+
+URL_SCHEME = re.compile(r"([a-zA-Z][a-zA-Z0-9+.-]*):(?!\d)")     # "https:" but not "localhost:8000"
+MAX_INTERNED_URLS = 4096
+RESOLVE_CACHE_SIZE = 4096
+
+# Immutable and interned: URL("https://example.org/") twice gives back the same object,
+# and its string parts are sys.intern'd, so equal URLs share memory and compare cheaply.
 class URL:
-    def __init__(self, url):
-        self.scheme, url = url.split("://", 1)
-        assert self.scheme in ["http", "https"]
+    __slots__ = ("scheme", "host", "port", "path", "string", "hash")
+    interned = {}               # url string -> URL
+
+    def __new__(cls, url):
+        cached = URL.interned.get(url)
+        if cached is not None: return cached
+
+        self = object.__new__(cls)
+        original = url
+        if url.startswith("data:"):
+            # "data:[<media type>][;base64],<data>" has no host; the rest is kept whole in path
+            return self.init("data", "", None, url[len("data:"):], None)
+        scheme, url = url.split("://", 1)
+        assert scheme in SCHEMES
 
         if "/" not in url:
             url = url + "/"
-        self.host, url = url.split("/", 1)
-        self.path = "/" + url
+        host, url = url.split("/", 1)
+        path = "/" + url
 
-        if self.scheme == "http":
-            self.port = 80
-        elif self.scheme == "https":
-            self.port = 443
+        if scheme == "http":
+            port = 80
+        elif scheme == "https":
+            port = 443
+        elif scheme == "file":
+            port = None
 
-        if ":" in self.host:
-            self.host, port = self.host.split(":", 1)
-            self.port = int(port)
+        if ":" in host and port is not None:
+            host, port = host.split(":", 1)
+            port = int(port)
         
         """
         website url: https://en.wikipedia.org/wiki/OpenAI
@@ -26,158 +135,329 @@ class URL:
         host = en.wikipedia.org/
         path = /wiki/OpenAI
         """
+
+        return self.init(scheme, host, port, path, original)
+
+    # original is the spelling to remember this URL under, or None to not intern it at all
+    # (data: URLs are their own content and rarely repeat)
+    def init(self, scheme, host, port, path, original):
+        if original is None:
+            string = scheme + ":" + path
+        else:
+            string = sys.intern(self.origin_of(scheme, host, port) + path)
+            # Another spelling of a URL we already have ("http://a.org:80" for "http://a.org/")
+            cached = URL.interned.get(string)
+            if cached is not None:
+                if len(URL.interned) < MAX_INTERNED_URLS:
+                    URL.interned[original] = cached
+                return cached
+            path = sys.intern(path)
+
+        setattr_ = object.__setattr__
+        setattr_(self, "scheme", sys.intern(scheme))
+        setattr_(self, "host", sys.intern(host))
+        setattr_(self, "port", port)
+        setattr_(self, "path", path)
+        setattr_(self, "string", string)
+        setattr_(self, "hash", hash(string))
+
+        # Keep the table bounded; with a full table, just stop interning new spellings
+        if original is not None and len(URL.interned) < MAX_INTERNED_URLS:
+            URL.interned[original] = self
+            URL.interned.setdefault(string, self)
+        return self
+
+    def __setattr__(self, name, value):
+        raise AttributeError("URL objects are immutable")
+
+    def __eq__(self, other):
+        return isinstance(other, URL) and self.string == other.string
+
+    def __hash__(self):
+        return self.hash
+
+    def __repr__(self):
+        return "URL({!r})".format(self.string)
+
+    @staticmethod
+    def origin_of(scheme, host, port):
+        port_part = ":" + str(port)
+        if port is None:
+            port_part = ""
+        if scheme == "https" and port == 443:
+            port_part = ""
+        if scheme == "http" and port == 80:
+            port_part = ""
+        return scheme + "://" + host + port_part
+
+    # "https://example.org:8443"; what relative links are resolved against
+    def origin(self):
+        return self.origin_of(self.scheme, self.host, self.port)
     
-    # Creating a socket (Request and Response)
-    def request(self, payload= None):
-        s = socket.socket(
-            family=socket.AF_INET,
-            type=socket.SOCK_STREAM,
-            proto=socket.IPPROTO_TCP,
-        )
-        s.connect((self.host, self.port))
-
-        if self.scheme == "https":
-            ctx = ssl.create_default_context()
-            s = ctx.wrap_socket(s, server_hostname=self.host)
+    # Creating a socket (Request and Response). Concurrent GETs of the same URL,
+    # from any tab or the prefetcher, share a single transfer. With a RequestLog,
+    # every hop's timing breakdown is added to it; with a TextSink, the final
+    # response's body is handed to it while it downloads.
+    def request(self, payload= None, max_redirects= MAX_REDIRECTS, log= None, sink= None):
+        return self.request_with_url(payload, max_redirects, log, sink)[1]
 
+    # Same as request, but returns the URL the body came from along with it: after a
+    # redirect that is the target, which the document's links are relative to
+    def request_with_url(self, payload= None, max_redirects= MAX_REDIRECTS, log= None, sink= None):
+        if self.scheme in LOCAL_SCHEMES:
+            return self, self.request_local(log, sink)
+        if payload:
+            return self.follow_redirects(payload, max_redirects, log, sink)
+        timing = RequestTiming(self, "GET")     # logged only if another caller's transfer is used
+        return IN_FLIGHT.do(flight_key("GET", self),
+                            lambda: self.follow_redirects(None, max_redirects, log, sink),
+                            lambda error: timing.shared(log, error))
+
+    def request_local(self, log, sink= None):
+        timing = RequestTiming(self, "GET")
+        timing.source = "local"
+        try:
+            text = load_local(self, sink)
+        except Exception as e:
+            timing.finish(error=e)
+            raise
+        else:
+            timing.finish()
+        finally:
+            timing.download = timing.total
+            if log is not None: log.add(timing)
+        return text
+
+    def follow_redirects(self, payload, max_redirects, log= None, sink= None):
+        url = PERMANENT_REDIRECTS.lookup(self) if not payload else self    # skip hops we already know about
+        for hop in range(max_redirects + 1):
+            status, response_headers, content = url.request_once(payload, log, sink)
+            target = redirect_target(url, status, response_headers)
+            if target is None:
+                return url, decode_text(content, response_headers)  # the one bytes -> str step, in the page's charset
+            if status in PERMANENT_REDIRECT_STATUSES:
+                PERMANENT_REDIRECTS.remember(url, target)
+            # 303 always, and 301 / 302 after a POST, continue as a GET (what every browser does)
+            if status == 303 or (payload and status in (301, 302)):
+                payload = None
+            url = target
+        raise TooManyRedirects("more than {} redirects from {}".format(max_redirects, self))
+
+    # One request, no redirects. Returns the status, headers and body bytes.
+    def request_once(self, payload= None, log= None, sink= None):
         method = "POST" if payload else "GET"
+        timing = RequestTiming(self, method)
+        try:
+            result = self.cached_or_fetched(method, payload, timing, sink)
+        except Exception as e:
+            timing.finish(error=e)
+            raise
+        else:
+            timing.finish(result[0])
+        finally:
+            if log is not None: log.add(timing)
+        return result
 
-        # Sending the Request
-        request = "{} {} HTTP/1.0\r\n".format(method, self.path)    # \r\n: \r means go to the start of current line, \n means go to the next line.
+    def cached_or_fetched(self, method, payload, timing, sink= None):
+        key = str(self)
+        # Normally self.fetch over the pool; a recorded or in-process server when benchmarking
+        transport = get_transport()
+        if not transport.cached:
+            return transport.fetch(self, method, payload, {}, timing, sink)
+
+        # A fresh cache entry answers without any network at all; a stale one
+        # with an ETag / Last-Modified turns the GET into a conditional one.
+        entry = HTTP_CACHE.lookup_fresh(key, method)
+        if entry and entry.is_fresh():
+            timing.source = "cache"
+            return entry.status, entry.headers, entry.body
+        headers = HTTP_CACHE.conditional_headers(entry)
+
+        status, response_headers, content = transport.fetch(self, method, payload, headers, timing, sink)
+        if status == 304 and entry:
+            timing.source = "revalidated"
+        return HTTP_CACHE.complete(key, method, entry, status, response_headers, content)
+
+    # Do one exchange with the server over a pooled connection
+    def fetch(self, method, payload, headers, timing, sink= None):
+        # A pooled socket may have been closed by the server while it sat idle.
+        # That only shows up once we use it, so retry once on a fresh connection
+        # (if nothing came back and the method is safe to repeat, see may_retry).
+        for attempt in range(2):
+            conn = POOL.acquire(self.scheme, self.host, self.port)
+            timing.connection(conn)
+            received_before = conn.reader.bytes_read
+            try:
+                status, response_headers, content, keep_alive = \
+                    self.exchange(conn, method, payload, headers, timing, sink)
+            except OSError:
+                POOL.discard(conn)
+                if attempt == 0 and may_retry(conn, method, conn.reader.bytes_read - received_before): continue
+                raise
+            except BaseException:
+                POOL.discard(conn)      # a garbled response (bad status line, chunk size, gzip): never reuse it
+                raise
+            break
+
+        if keep_alive:
+            POOL.release(conn)
+        else:
+            POOL.discard(conn)
+        return status, response_headers, content
+
+    def request_bytes(self, method, payload, headers):
+        request = "{} {} HTTP/1.1\r\n".format(method, self.path)    # \r\n: \r means go to the start of current line, \n means go to the next line.
         request += "Host: {}\r\n".format(self.host) 
+        request += "Connection: keep-alive\r\n"
+        request += "Accept-Encoding: {}\r\n".format(ACCEPT_ENCODING)
+        for header, value in headers.items():
+            request += "{}: {}\r\n".format(header, value)
         if payload:
             length = len(payload.encode("utf8"))
             request += "Content-Length: {}\r\n".format(length)
         request += "\r\n"             # add blank line at end of request, if not, the other computer keeps waiting.
         if payload: request += payload
-        s.send(request.encode("utf8"))
+        return request.encode("utf8")
+
+    # Send one request over conn and read back exactly one response
+    def exchange(self, conn, method, payload, headers, timing, sink= None):
+        # Sending the Request
+        request = self.request_bytes(method, payload, headers)
+        start = time.perf_counter()
+        received_before = conn.reader.bytes_read
+        conn.send(request)
+        sent = time.perf_counter()
 
         """
         the request looks like this for a url of http://example.org/homepage :
-        GET /homepage HTTP/1.0
+        GET /homepage HTTP/1.1
         Host: example.org
+        Connection: keep-alive
+        Accept-Encoding: gzip, deflate
 
         """
 
         # Recieving the Response. 
-        # Makefile returns file-like obj containing every byte we recieve from server
-        response = s.makefile("r", encoding="utf8", newline="\r\n") 
+        # conn.reader keeps the raw bytes in a bytearray; it lives as long as the connection
+        response = conn.reader
         """
         Example response:
-        HTTP/1.0 200 OK\r\n
+        HTTP/1.1 200 OK\r\n
         Content-Type: text/html; charset=UTF-8\r\n
         Content-Length: 44\r\n
         \r\n
         <html><body>Hello World!</body></html>
         """
 
-        statusline = response.readline()
-        version, status, explanation = statusline.split(" ", 2)
+        version, status, explanation, response_headers = response.read_head()
+        head_in = time.perf_counter()
         """
-        statusline = HTTP/1.0 200 OK
-        version = HTTP/1.0
+        statusline = HTTP/1.1 200 OK
+        version = HTTP/1.1
         status = 200
         explanation = OK
-        """
-
-        response_headers = {}
-        while True:
-            line = response.readline()
-            if line == "\r\n": break
-            header, value = line.split(":", 1)
-            response_headers[header.casefold()] = value.strip()
-        """
-        line = 
-            Content-Type: text/html; charset=UTF-8\r\n
-            Content-Length: 44\r\n
-        header = 
-            "Content-Type"
-            "Content-Length"
-        value = 
-            " text/html; charset=UTF-8"
-            " 44"
         response_headers = {
             "content-type": "text/html; charset=UTF-8",
             "content-length": "44"
         }
         """
 
-        assert "transfer-encoding" not in response_headers
-        assert "content-encoding" not in response_headers
-
-        content = response.read() # Everything after the headers
-        s.close()
+        keep_alive = keeps_alive(version, response_headers)
+        if not has_body(method, status):
+            content = b""
+        else:
+            # With a Content-Length this is one recv_into a buffer of exactly that size;
+            # otherwise chunked / read-to-close framing plus gzip or deflate decoding.
+            # A redirect's body is never the document, so only a final response is streamed.
+            if sink and not is_redirect(status, response_headers):
+                sink.begin(response_headers, self)
+                content = response.read_body(response_headers, sink.write)
+                sink.end()
+            else:
+                content = response.read_body(response_headers)
+            if not has_framing(response_headers):
+                keep_alive = False      # no framing, the body ended because the server closed
         """
         content = <html><body>Hello World!</body></html>
         """
 
-        return content     
+        timing.send = sent - start
+        timing.ttfb = head_in - sent
+        timing.download = time.perf_counter() - head_in
+        timing.bytes_sent = len(request)
+        timing.bytes_received = conn.reader.bytes_read - received_before
+
+        return status, response_headers, content, keep_alive
 
+    # Relative link -> absolute URL. Memoized per (base, link): a page resolves the
+    # same hrefs over and over (every click, every load, every hover).
     def resolve(self, url):
         if not url: return None
+        return resolve_url(self, url)
 
-        url = url.strip()
-        url = url.strip('"')
-        print(f"DEBUG: URL IS -> {url}")
-        
-        if "://" in url: return URL(url)
+    def __str__(self):
+        return self.string
 
-        if url.startswith("#") or url.startswith("javascript:"):
-            return None
+"""
+Resolving a link against a base URL (RFC 3986 section 5.2):
+    "https://other.org/x"   -> already complete, parsed as is
+    "#top", "javascript:.." -> not something we navigate to, None
+    "//cdn.example.org/a"   -> protocol relative, keeps the base's scheme
+    "/a/./b/../c"           -> host relative, dot segments removed: /a/c
+    "?page=2"               -> same path as the base, new query
+    "../style.css"          -> relative to the base's directory
+        base path "/articles/tech/index.html" -> "/articles/tech/" + "../style.css"
+        -> remove_dot_segments -> "/articles/style.css"
+"""
 
-        """
-        if not url.startswith("/"):
-            dir, _ = self.path.rsplit("/", 1)
-            while url.startswith("../"):
-                _, url = url.split("/", 1)            
-                if "/" in dir: 
-                    dir, _ = dir.rsplit("/", 1)
-            url = dir + "/" + url 
-        """
+# RFC 3986 5.2.4: drop "." segments and let each ".." remove the segment before it
+def remove_dot_segments(path):
+    query = ""
+    if "?" in path:
+        path, query = path.split("?", 1)
+        query = "?" + query
+    output = []
+    segments = path.split("/")
+    for i, segment in enumerate(segments):
+        last = i == len(segments) - 1
+        if segment == ".":
+            if last: output.append("")
+        elif segment == "..":
+            if len(output) > 1: output.pop()
+            if last: output.append("")
+        else:
+            output.append(segment)
+    result = "/".join(output)
+    if not result.startswith("/"):
+        result = "/" + result
+    return result + query
 
-        if url.startswith("/"):
-            return URL(f"{self.scheme}://{self.host}:{self.port}{url}")
+@functools.lru_cache(maxsize=RESOLVE_CACHE_SIZE)
+def resolve_url(base, url):
+    url = url.strip()
+    url = url.strip('"')
+    if not url: return None
 
-        if url.startswith("//"):
-            return URL(self.scheme + "://" + self.host + ":" + str(self.port) + url)  
-        
-        dir, _ = self.path.rsplit("/", 1)
-        while url.startswith("../"):
-            url = url[3:] # strip leading../
-            if "/" in dir:
-                dir, _ = dir.rsplit("/", 1)
-        
-        full_path = f"{dir}/{url}"
-        return URL(f"{self.scheme}://{self.host}:{self.port}{full_path}")
-    
-    def __str__(self):
-        port_part = ":" + str(self.port)
-        if self.scheme == "https" and self.port == 443:
-            port_part = ""
-        if self.scheme == "http" and self.port == 80:
-            port_part = ""
-        return self.scheme + "://" + self.host + port_part + self.path
- 
-        """
-        First if statement:
-            --> handles already complete urls
-            --> returns the url as is
-
-        Second if statement: (parent or host relative)
-            --> Handle relative paths that don't start with a slash (e.g. "another-page.html") 
-            --> These are relative to the *current directory* of the URL
-            1) get dir part of current path. e.g if self.path is "/articles/tech/index.html", dir = "/articles/tech"
-            2) while loop: (for parent relatives)
-                --> handles "go up one dir" paths like "../style.css". For each "../" at the start of URL...
-                1) remove the "../" from url
-                2) go one level up in dir path
-                    --> e.g if dir is "/articles/tech" it becomes "/articles"
-            3) combine dir path and relative URL to make full path 
-                --> e.g. if dir = "/articles" and url = "style.css", url becomes "/articles/style.css
-
-        Third if statement: (for protocol relatives)
-            --> handles urls starting with "//" (e.g: "//example.com/image.png) 
-            --> uses same scheme (http or https) as current page
-            1) rebuild url from its components 
-        """
-         
\ No newline at end of file
+    if url.startswith("#"): return None
+    scheme = URL_SCHEME.match(url)
+    if scheme:
+        # "javascript:", "mailto:" and friends are not something we can load
+        name = scheme.group(1).casefold()
+        if name not in SCHEMES: return None
+        url = URL(name + url[len(name):])
+        if url.scheme == "data" or "/." not in url.path: return url
+        return URL(url.origin() + remove_dot_segments(url.path))
+
+    if base.scheme == "data": return None      # nothing to be relative to
+    origin = base.origin()
+    if url.startswith("//"):
+        return URL(base.scheme + ":" + url)
+    if url.startswith("/"):
+        return URL(origin + remove_dot_segments(url))
+
+    base_path = base.path.split("?", 1)[0].split("#", 1)[0]
+    if url.startswith("?"):
+        return URL(origin + base_path + url)
+
+    dir, _ = base_path.rsplit("/", 1)
+    return URL(origin + remove_dot_segments(dir + "/" + url))